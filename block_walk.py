@@ -0,0 +1,146 @@
+import logging
+import os
+import threading
+import time
+
+from commands.getblocks import build_getblocks
+from commands.headers import locator_heights
+from constants import GENESIS_HASH
+from utils import make_parent_dir
+
+MAX_BLOCKS_PER_INV = 500  # tyle hashy zwraca na raz getblocks w Bitcoin Core
+
+
+class BlockHashWalk:
+    """Enumerates the peer's block hashes with repeated getblocks, from genesis or a checkpoint.
+
+    Hashes are kept in one bytearray, 32 bytes per height (about 29 MB for
+    900k blocks). When a full batch of 500 arrives the next getblocks, with a
+    locator built from the new tip, is sent before the batch is written out, so
+    the peer is already working on it. A batch shorter than 500 means we reached
+    the peer's tip. Every batch is appended to a checkpoint file, which a new
+    walk reads back to resume.
+
+    inv carries no parent hashes, so an inv is taken as the answer only if it
+    can be one: a full batch, or a shorter one reaching the peer's height, not
+    starting inside the previous batch (a late answer to a repeated request),
+    and - when the first block's parent is known from headers - continuing the
+    tip the request was built from. A reorg during the walk is still not
+    detected (check the result against headers).
+
+    add_batch() runs on the message handling thread and stalled() on the
+    reading thread; the request state and hashes are guarded by lock.
+    """
+
+    def __init__(self, path="block_hashes.bin", genesis_hash=GENESIS_HASH, retry_after=30.0, max_retries=3):
+        self.logger = logging.getLogger('bitcoin')
+        self.path = path
+        self.retry_after = retry_after
+        self.max_retries = max_retries
+        self.hashes = bytearray(bytes.fromhex(genesis_hash)[::-1])
+        self.complete = False
+        self.waiting = False
+        self.requested_at = 0.0
+        self.retries = 0
+        self.requested_tip: bytes | None = None  # tip, od ktorego zbudowany byl lokator ostatniego getblocks
+        self.last_batch: set[bytes] = set()
+        self.lock = threading.RLock()
+        self._saved = 0  # ile bajtow hashes jest juz w pliku
+        make_parent_dir(path)
+        self.load()
+
+    def __len__(self):
+        return len(self.hashes) // 32
+
+    def tip_height(self):
+        return len(self) - 1
+
+    def hash_at(self, height) -> bytes:
+        return bytes(self.hashes[height * 32:height * 32 + 32])
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return
+        # urwany ostatni zapis: zostawiamy tylko pelne hashe
+        data = data[:len(data) // 32 * 32]
+        if data[:32] != self.hashes[:32]:
+            self.logger.info(f"{self.path} does not start at our genesis, starting from scratch")
+            return
+        self.hashes = bytearray(data)
+        self._saved = len(data)
+        if os.path.getsize(self.path) != len(data):
+            os.truncate(self.path, len(data))
+        self.logger.info(f"Block walk resumed at height {self.tip_height()}")
+
+    def locator(self) -> list[bytes]:
+        """Last 10 hashes, then exponentially sparser ones back to genesis."""
+        return [self.hash_at(h) for h in locator_heights(self.tip_height())]
+
+    def request(self) -> bytes:
+        """getblocks payload for the next batch."""
+        with self.lock:
+            self.waiting = True
+            self.requested_at = time.monotonic()
+            self.requested_tip = self.hash_at(self.tip_height())
+            return build_getblocks(self.locator())
+
+    def accepts(self, block_hashes, peer_height=None, parent_of=None) -> bool:
+        """Whether an inv with these block hashes is the answer to our getblocks.
+
+        parent_of(hash) returns the parent hash from the header chain, or None
+        for an unknown header. A batch shorter than 500 is taken only when it
+        reaches the peer's height - otherwise it is a new block announcement
+        arriving while we wait.
+        """
+        with self.lock:
+            if not self.waiting or not block_hashes:
+                return False
+            first = block_hashes[0]
+            if first in self.last_batch:
+                return False
+            if len(block_hashes) < MAX_BLOCKS_PER_INV and peer_height is not None \
+                    and self.tip_height() + len(block_hashes) < peer_height:
+                return False
+            parent = None if parent_of is None else parent_of(first)
+            return parent is None or parent == self.requested_tip or first == self.requested_tip
+
+    def add_batch(self, block_hashes) -> bool:
+        """Appends an inv batch; True if another getblocks should be sent right away."""
+        with self.lock:
+            self.waiting = False
+            self.retries = 0
+            self.last_batch = set(block_hashes)
+            tip = self.hash_at(self.tip_height())
+            for block_hash in block_hashes:
+                if block_hash != tip:
+                    self.hashes += block_hash
+            if len(block_hashes) < MAX_BLOCKS_PER_INV:
+                self.complete = True
+                self.logger.info(f"Block walk complete at height {self.tip_height()}")
+            return not self.complete
+
+    def stalled(self) -> bool:
+        """True if the request went unanswered for retry_after s; gives up after max_retries."""
+        with self.lock:
+            if not self.waiting or time.monotonic() - self.requested_at < self.retry_after:
+                return False
+            self.retries += 1
+            if self.retries > self.max_retries:
+                # Core nie odpowiada, gdy nie ma nic nowego - pelna ostatnia paczka konczyla sie na jego tipie
+                self.waiting = False
+                self.complete = True
+                self.logger.info(f"Block walk: no answer, assuming height {self.tip_height()} is the peer's tip")
+                return False
+            return True
+
+    def checkpoint(self) -> None:
+        """Appends hashes added since the last checkpoint to the file."""
+        with self.lock:
+            if self._saved == len(self.hashes):
+                return
+            with open(self.path, "ab") as f:
+                f.write(self.hashes[self._saved:])
+            self._saved = len(self.hashes)
@@ -0,0 +1,124 @@
+import functools
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+_MISSING = object()
+
+# wszystkie nazwane cache, do podgladu hit rate (cache_stats); znikaja razem z wlascicielem
+CACHES = weakref.WeakSet()
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry; counts hits and misses."""
+
+    def __init__(self, maxsize=1024, name=None):
+        self.maxsize = maxsize
+        self.name = name
+        self.data: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if name is not None:
+            CACHES.add(self)
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._touch(key)
+            return value
+
+    def put(self, key, value) -> None:
+        with self.lock:
+            self._store(key, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            value = self._lookup(key)
+            self.data.pop(key, None)
+            return default if value is _MISSING else value
+
+    def clear(self) -> None:
+        with self.lock:
+            self.data.clear()
+
+    def __contains__(self, key):
+        with self.lock:
+            return self._lookup(key) is not _MISSING
+
+    def __len__(self):
+        return len(self.data)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {"name": self.name, "size": len(self.data), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate()}
+
+    def _lookup(self, key):
+        return self.data.get(key, _MISSING)
+
+    def _store(self, key, value):
+        self.data[key] = value
+
+    def _touch(self, key):
+        self.data.move_to_end(key)
+
+
+class TTLCache(LRUCache):
+    """LRUCache whose entries also expire ttl seconds after they were stored.
+
+    Entries stay in insertion order (get() does not move them), so the
+    oldest - first to be evicted - are also the first to expire.
+    """
+
+    def __init__(self, maxsize=1024, ttl=600.0, name=None):
+        super().__init__(maxsize, name)
+        self.ttl = ttl
+
+    def _lookup(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return _MISSING
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.data[key]
+            return _MISSING
+        return value
+
+    def _store(self, key, value):
+        # wpis przeniesiony na koniec, wiec najstarsze (i najwczesniej wygasajace) sa z przodu
+        self.data.pop(key, None)
+        self.data[key] = (time.monotonic() + self.ttl, value)
+
+    def _touch(self, key):
+        pass
+
+
+def cached(cache):
+    """Memoizes a one-argument function in the given cache."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(arg):
+            value = cache.get(arg, _MISSING)
+            if value is _MISSING:
+                value = func(arg)
+                cache.put(arg, value)
+            return value
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+def cache_stats():
+    return sorted((cache.stats() for cache in CACHES), key=lambda stats: stats["name"])
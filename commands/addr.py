@@ -1,17 +1,55 @@
+import base64
+import hashlib
 import json
 import random
+import struct
 from datetime import datetime
 
 from constants import BYTE_IN_CHARS
 import logging
-import logging_config
 from ipaddress import IPv6Address, ip_address
 
 from node import Node
-from utils import bytes_to_int, hex_str_to_int
+from utils import bytes_to_int, hex_str_to_int, read_varint, MalformedMessage
+
+# BIP155 network ids -> expected address length in bytes
+NET_IPV4 = 1
+NET_IPV6 = 2
+NET_TORV2 = 3
+NET_TORV3 = 4
+NET_I2P = 5
+NET_CJDNS = 6
+ADDRV2_LENGTHS = {NET_IPV4: 4, NET_IPV6: 16, NET_TORV2: 10, NET_TORV3: 32, NET_I2P: 32, NET_CJDNS: 16}
+MAX_ADDRV2_SIZE = 512
+VARINT_LENGTHS = {0xfd: 3, 0xfe: 5, 0xff: 9}
+
+
+def read_varint_v2(payload, offset):
+    """read_varint that raises MalformedMessage instead of reading past the end of an addrv2 payload."""
+    if offset >= len(payload) or offset + VARINT_LENGTHS.get(payload[offset], 1) > len(payload):
+        raise MalformedMessage("addrv2", f"truncated at byte {offset}")
+    return read_varint(payload, offset)
+
+
+def decode_addrv2_ip(network_id, raw):
+    """Returns an ip_address object for IP networks, or the .onion / .b32.i2p name."""
+    if network_id == NET_IPV4:
+        # zapisujemy jak w addr (v1): IPv4 jako IPv4-mapped IPv6
+        return IPv6Address(b'\x00' * 10 + b'\xff\xff' + raw)
+    if network_id in (NET_IPV6, NET_CJDNS):
+        return IPv6Address(raw)
+    if network_id == NET_TORV2:
+        return base64.b32encode(raw).decode('ascii').lower() + ".onion"
+    if network_id == NET_TORV3:
+        version = b'\x03'
+        checksum = hashlib.sha3_256(b".onion checksum" + raw + version).digest()[:2]
+        return base64.b32encode(raw + checksum + version).decode('ascii').lower() + ".onion"
+    return base64.b32encode(raw).decode('ascii').lower().rstrip("=") + ".b32.i2p"
 
 
 class Address:
+    __slots__ = ("timestamp", "services", "ip", "port")
+
     def __init__(self, data):
         a_tuple = self.unpack(data)
         self.timestamp = a_tuple[0]
@@ -19,6 +57,15 @@ class Address:
         self.ip = a_tuple[2]
         self.port = a_tuple[3]
 
+    @classmethod
+    def from_fields(cls, timestamp, services, ip, port):
+        address = cls.__new__(cls)
+        address.timestamp = timestamp
+        address.services = services
+        address.ip = ip
+        address.port = port
+        return address
+
     def __str__(self):
         return ("timestamp: " + str(self.timestamp) + "\nservices: " + str(self.services) +
                 "\nip: " + str(self.ip) + "\nport: " + str(self.port) + "\n")
@@ -66,14 +113,53 @@ class Addr:
             a_list.append(Address(address))
         return sorted(a_list, key=lambda x: x.timestamp, reverse=True)
 
+    # addrv2 (BIP155): time, services jako varint, network id, adres o zmiennej dlugosci, port big-endian
+    def unpack_addresses_v2(self, data):
+        payload = bytes.fromhex(data)
+        count, offset = read_varint_v2(payload, 0)
+        self.logger.info("addrv2 count: " + str(count) + "\n")
+        a_list = []
+        for _ in range(count):
+            # ucieta wiadomosc to blad peera, nie koniec listy - PeerGuard liczy ja jako malformed
+            if offset + 4 > len(payload):
+                raise MalformedMessage("addrv2", f"truncated at byte {offset}")
+            timestamp = struct.unpack_from('<I', payload, offset)[0]
+            services, offset = read_varint_v2(payload, offset + 4)
+            if offset >= len(payload):
+                raise MalformedMessage("addrv2", f"truncated at byte {offset}")
+            network_id = payload[offset]
+            addr_len, offset = read_varint_v2(payload, offset + 1)
+            if addr_len > MAX_ADDRV2_SIZE:
+                raise MalformedMessage("addrv2", f"address of {addr_len} bytes")
+            if offset + addr_len + 2 > len(payload):
+                raise MalformedMessage("addrv2", f"truncated at byte {offset}")
+            raw = payload[offset:offset + addr_len]
+            port = struct.unpack_from('>H', payload, offset + addr_len)[0]
+            offset += addr_len + 2
+
+            # nieznane sieci i zle dlugosci pomijamy (BIP155)
+            if ADDRV2_LENGTHS.get(network_id) != addr_len:
+                continue
+            a_list.append(Address.from_fields(
+                datetime.fromtimestamp(timestamp),
+                struct.pack('<Q', services).hex(),
+                decode_addrv2_ip(network_id, raw),
+                port
+            ))
+        return sorted(a_list, key=lambda x: x.timestamp, reverse=True)
+
     def save(self, a_list):
         with open("addresses.json", "w") as f:
             json.dump([a.to_dict() for a in a_list], f, indent=2)
 
-    def draw(self):
-        with open("addresses.json", "r") as f:
-            addresses = json.load(f)
-        addresses_8333 = [a for a in addresses if a["port"] == 8333]
+    def draw(self, path="addresses.json", port=8333):
+        try:
+            with open(path, "r") as f:
+                addresses = json.load(f)
+        except OSError:
+            return None
+        # adresy Tor/I2P (addrv2) nie sa adresami IP, wiec nie da sie do nich polaczyc bezposrednio
+        addresses_8333 = [a for a in addresses if a["port"] == port and ":" in a["ip"]]
         if not addresses_8333:
             return None
 
@@ -0,0 +1,214 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+from ipaddress import ip_address
+
+from commands.addr import Addr, Address
+from commands.addr_table import AddressTable
+from commands.addr_utils import is_overlay, normalize_ip, DEFAULT_PORT, FLAGS_SENSIBLE
+from utils import make_parent_dir
+
+
+class AddrStore:
+    """Global (ip, port) index of gossiped addresses, persisted to addresses.json.
+
+    IP addresses live in a packed AddressTable; the few Tor/I2P entries from addrv2
+    (which do not fit a 16-byte IP column) are kept as Address objects in overlay.
+
+    The receive loop only calls submit(), which never touches the disk. A background
+    writer thread merges queued batches into the index (keeping the newest timestamp
+    per address) and rewrites the file once batch_size new entries have been merged
+    or flush_interval seconds have passed.
+
+    Banned peer IPs (see PeerGuard) are kept in ban_path with their expiry time;
+    draw() does not return them.
+    """
+
+    def __init__(self, path="addresses.json", max_queue=1000, batch_size=500, flush_interval=30.0,
+                 ban_path="banned.json", default_port=DEFAULT_PORT):
+        self.logger = logging.getLogger('bitcoin')
+        self.path = path
+        self.ban_path = ban_path
+        # ip -> (koniec bana jako unix time, powod); wczytywane przy pierwszym uzyciu
+        self.bans: dict[str, tuple[float, str]] | None = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.table = AddressTable(default_port)
+        self.overlay: dict[tuple[str, int], Address] = {}
+        self.lock = threading.Lock()
+        # zapis banned.json; osobno od lock, zeby draw/merge nie czekaly na dysk
+        self.ban_lock = threading.Lock()
+        self.dropped = 0
+        self._dirty = 0
+        self._last_flush = time.monotonic()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __len__(self):
+        with self.lock:
+            return len(self.table) + len(self.overlay)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="addr-store", daemon=True)
+        self._thread.start()
+
+    def submit(self, a_list) -> bool:
+        """Queues a decoded addr/addrv2 batch; drops it (and counts it) when the queue is full."""
+        if self._thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(a_list)
+            return True
+        except queue.Full:
+            self.dropped += len(a_list)
+            self.logger.debug("addr store queue full, dropped " + str(len(a_list)) + " addresses\n")
+            return False
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._stop.clear()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.merge(self.dict_to_address(entry) for entry in entries)
+        self._dirty = 0
+
+    @staticmethod
+    def dict_to_address(entry):
+        ip = entry["ip"]
+        try:
+            ip = ip_address(ip)
+        except ValueError:
+            pass  # .onion / .b32.i2p
+        return Address.from_fields(datetime.fromisoformat(entry["timestamp"]), entry["services"], ip, entry["port"])
+
+    def merge(self, a_list):
+        with self.lock:
+            for address in a_list:
+                if not is_overlay(address.ip):
+                    if self.table.merge_address(address) >= 0:
+                        self._dirty += 1
+                    continue
+                key = (str(address.ip), address.port)
+                known = self.overlay.get(key)
+                if known is None or address.timestamp > known.timestamp:
+                    self.overlay[key] = address
+                    self._dirty += 1
+
+    def sensible(self, required=FLAGS_SENSIBLE):
+        """Known IP addresses passing the precomputed flag filter (column scan)."""
+        with self.lock:
+            return list(self.table.addresses(self.table.select(required)))
+
+    def draw(self):
+        """Random known address passing the flag filter as a Node, or None."""
+        with self.lock:
+            rows = self.table.select()
+            if not rows:
+                return None
+            for _ in range(20):
+                address = self.table.address(random.choice(rows))
+                if not self._is_banned(normalize_ip(address.ip)):
+                    break
+            else:
+                return None
+        return Addr().dict_to_node(address.to_dict())
+
+    def ban(self, ip, duration, reason="") -> None:
+        key = normalize_ip(ip)
+        # snapshot i zapis pod ban_lock: rownolegle bany nie przeplataja zapisow do .tmp
+        # i nowszy snapshot nie moze zostac nadpisany starszym
+        with self.ban_lock:
+            with self.lock:
+                self._load_bans()[key] = (time.time() + duration, reason)
+                bans = [{"ip": banned, "until": until, "reason": why} for banned, (until, why) in self.bans.items()]
+            self.logger.info(f"Banned {key} for {duration:.0f} s: {reason}")
+            tmp_path = self.ban_path + ".tmp"
+            try:
+                make_parent_dir(self.ban_path)
+                with open(tmp_path, "w") as f:
+                    json.dump(bans, f, indent=2)
+                os.replace(tmp_path, self.ban_path)
+            except OSError as e:
+                self.logger.error("saving bans failed: " + str(e))
+
+    def is_banned(self, ip) -> bool:
+        key = normalize_ip(ip)
+        with self.lock:
+            return self._is_banned(key)
+
+    def _is_banned(self, key):
+        entry = self._load_bans().get(key)
+        if entry is None:
+            return False
+        if entry[0] > time.time():
+            return True
+        del self.bans[key]
+        return False
+
+    def _load_bans(self):
+        if self.bans is None:
+            self.bans = {}
+            try:
+                with open(self.ban_path, "r") as f:
+                    entries = json.load(f)
+            except (OSError, ValueError):
+                entries = []
+            now = time.time()
+            for entry in entries:
+                if entry["until"] > now:
+                    self.bans[entry["ip"]] = (entry["until"], entry.get("reason", ""))
+        return self.bans
+
+    def flush(self):
+        with self.lock:
+            snapshot = list(self.table.addresses()) + list(self.overlay.values())
+            self._dirty = 0
+        self._last_flush = time.monotonic()
+
+        snapshot.sort(key=lambda x: x.timestamp, reverse=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump([a.to_dict() for a in snapshot], f, indent=2)
+        os.replace(tmp_path, self.path)
+        self.logger.debug("addr store flushed " + str(len(snapshot)) + " addresses\n")
+
+    def _run(self):
+        self.load()
+        try:
+            make_parent_dir(self.path)
+        except OSError as e:
+            self.logger.error("addr store directory: " + str(e))
+        while not self._stop.is_set() or not self.queue.empty():
+            try:
+                self.merge(self.queue.get(timeout=1.0))
+            except queue.Empty:
+                pass
+
+            if self._dirty and (self._dirty >= self.batch_size
+                                or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._safe_flush()
+        if self._dirty:
+            self._safe_flush()
+
+    def _safe_flush(self):
+        try:
+            self.flush()
+        except OSError as e:
+            self.logger.error("addr store flush failed: " + str(e))
@@ -0,0 +1,101 @@
+from array import array
+from datetime import datetime
+from ipaddress import IPv4Address, IPv6Address
+
+from commands.addr import Address
+from commands.addr_utils import address_flags, services_to_int, DEFAULT_PORT, FLAGS_SENSIBLE
+
+
+class AddressTable:
+    """Column store for IP peer addresses.
+
+    One row is 16 bytes of IP (IPv4 stored IPv4-mapped), uint64 services, uint32
+    time, uint16 port and a uint8 flag byte (see addr_utils.FLAG_*), so about 31
+    bytes per address instead of an Address object with its datetime, hex string
+    and ipaddress object. Flags are classified once on insert, so filtering is a
+    scan over the flag column. The (ip, port) dedup index is an open-addressing
+    hash table of row numbers (array of int64), not a dict of Python keys.
+    """
+
+    def __init__(self, default_port=DEFAULT_PORT):
+        self.default_port = default_port
+        self.ips = bytearray()
+        self.services = array('Q')
+        self.times = array('I')
+        self.ports = array('H')
+        self.flags = bytearray()
+        self._slots = array('q', [-1]) * 1024
+
+    def __len__(self):
+        return len(self.ports)
+
+    def _find(self, ip16: bytes, port: int) -> tuple[int, int]:
+        """Returns (slot, row) for the key; row is -1 when the address is unknown."""
+        mask = len(self._slots) - 1
+        slot = hash((ip16, port)) & mask
+        while True:
+            row = self._slots[slot]
+            if row < 0 or (self.ports[row] == port and self.ips[row * 16:row * 16 + 16] == ip16):
+                return slot, row
+            slot = (slot + 1) & mask
+
+    def _grow(self):
+        self._slots = array('q', [-1]) * (len(self._slots) * 2)
+        for row in range(len(self.ports)):
+            slot, _ = self._find(bytes(self.ips[row * 16:row * 16 + 16]), self.ports[row])
+            self._slots[slot] = row
+
+    @staticmethod
+    def pack_ip(ip) -> bytes:
+        if isinstance(ip, IPv4Address):
+            return b'\x00' * 10 + b'\xff\xff' + ip.packed
+        return ip.packed
+
+    def merge(self, ip16: bytes, services: int, timestamp: int, port: int) -> int:
+        """Adds the address or, if known, keeps the newer time and its services; returns the row."""
+        slot, row = self._find(ip16, port)
+        if row < 0:
+            row = len(self.ports)
+            self._slots[slot] = row
+            self.ips += ip16
+            self.services.append(services)
+            self.times.append(timestamp)
+            self.ports.append(port)
+            self.flags.append(address_flags(IPv6Address(ip16), services, port, self.default_port))
+            if len(self.ports) * 2 > len(self._slots):
+                self._grow()
+        elif timestamp > self.times[row]:
+            self.times[row] = timestamp
+            if services != self.services[row]:
+                self.services[row] = services
+                self.flags[row] = address_flags(IPv6Address(ip16), services, port, self.default_port)
+        else:
+            return -1
+        return row
+
+    def merge_address(self, address: Address) -> int:
+        return self.merge(self.pack_ip(address.ip), services_to_int(address.services),
+                          int(address.timestamp.timestamp()), address.port)
+
+    def select(self, required=FLAGS_SENSIBLE) -> list[int]:
+        """Row numbers whose flags contain all bits in required."""
+        try:
+            import numpy as np
+        except ImportError:
+            return [row for row, flags in enumerate(self.flags) if flags & required == required]
+        flags = np.frombuffer(self.flags, dtype=np.uint8)
+        return np.flatnonzero(flags & required == required).tolist()
+
+    def address(self, row: int) -> Address:
+        ip = IPv6Address(bytes(self.ips[row * 16:row * 16 + 16]))
+        return Address.from_fields(datetime.fromtimestamp(self.times[row]),
+                                   self.services[row].to_bytes(8, 'little').hex(), ip, self.ports[row])
+
+    def addresses(self, rows=None):
+        for row in range(len(self)) if rows is None else rows:
+            yield self.address(row)
+
+    def memory_usage(self) -> int:
+        """Bytes held by the columns and the dedup index."""
+        return (len(self.ips) + self.services.itemsize * len(self.services) + self.times.itemsize * len(self.times)
+                + self.ports.itemsize * len(self.ports) + len(self.flags) + self._slots.itemsize * len(self._slots))
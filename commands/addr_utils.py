@@ -1,23 +1,48 @@
-from ipaddress import ip_address, IPv6Address
+from ipaddress import ip_address, IPv4Address, IPv6Address
+
+from cache import LRUCache, cached
 
 NODE_NETWORK = 1
 
+# bity flag liczone raz przy dodaniu adresu (patrz AddressTable)
+FLAG_ROUTABLE = 1
+FLAG_NODE_NETWORK = 2
+FLAG_DEFAULT_PORT = 4
+FLAGS_SENSIBLE = FLAG_ROUTABLE | FLAG_NODE_NETWORK | FLAG_DEFAULT_PORT
+
+DEFAULT_PORT = 8333  # mainnet; inne sieci podaja swoj port (Network.port)
+
+# te same adresy przychodza od wielu peerow, a ipaddress (is_private itd.) jest wolny
+_ip_classes = LRUCache(65536, name="ip")
+_ip_names = LRUCache(65536, name="ip normalized")
+
 
+def is_overlay(ip):
+    return not isinstance(ip, (IPv4Address, IPv6Address)) and str(ip).endswith((".onion", ".i2p"))
+
+
+@cached(_ip_names)
 def normalize_ip(ip):
-    addr = ip_address(ip)
+    if is_overlay(ip):
+        return str(ip)
+    addr = ip if isinstance(ip, (IPv4Address, IPv6Address)) else ip_address(ip)
     if isinstance(addr, IPv6Address) and addr.ipv4_mapped:
         return str(addr.ipv4_mapped)
     return str(addr)
 
 
-def is_sensible_addr(addr):
-    ip = ip_address(addr.ip)
-    port = addr.port
+# services w addr sa zapisane jako 8 bajtow little-endian (hex)
+def services_to_int(services):
+    return int.from_bytes(bytes.fromhex(services), 'little')
 
-    services = int(addr.services, 16)
 
-    if port != 8333:
-        return False
+@cached(_ip_classes)
+def is_routable(ip):
+    if is_overlay(ip):
+        return True
+    ip = ip if isinstance(ip, (IPv4Address, IPv6Address)) else ip_address(ip)
+    if isinstance(ip, IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
 
     if ip.is_private or ip.is_loopback or ip.is_unspecified or ip.is_multicast:
         return False
@@ -25,14 +50,33 @@ def is_sensible_addr(addr):
     if str(ip) in ("0.0.0.0", "0.0.0.255"):
         return False
 
-    if not (services & NODE_NETWORK):
-        return False
-
     return True
 
 
+def address_flags(ip, services: int, port: int, default_port=DEFAULT_PORT) -> int:
+    flags = 0
+    if is_routable(ip):
+        flags |= FLAG_ROUTABLE
+    if services & NODE_NETWORK:
+        flags |= FLAG_NODE_NETWORK
+    if port == default_port:
+        flags |= FLAG_DEFAULT_PORT
+    return flags
+
+
+def is_sensible_addr(addr, default_port=DEFAULT_PORT):
+    """default_port: port of the network the address was gossiped on (Network.port)."""
+    flags = address_flags(addr.ip, services_to_int(addr.services), addr.port, default_port)
+    return flags & FLAGS_SENSIBLE == FLAGS_SENSIBLE
+
+
 def print_addr(addr):
     ip = normalize_ip(addr.ip)
-    proto = "IPv6" if ":" in ip else "IPv4"
+    if ip.endswith(".onion"):
+        proto = "Tor"
+    elif ip.endswith(".i2p"):
+        proto = "I2P"
+    else:
+        proto = "IPv6" if ":" in ip else "IPv4"
 
     print(f"[ADDR] {ip}:{addr.port} ({proto})")
@@ -0,0 +1,27 @@
+from commands.tx import Transaction, parse_transactions, merkle_root
+from utils import double_sha256, read_varint
+
+
+class Block:
+    """Full block: 80-byte header and parsed transactions (with their offsets in the payload)."""
+
+    def __init__(self, payload: bytes):
+        self.header = payload[:80]
+        self.hash = double_sha256(self.header)
+        count, offset = read_varint(payload, 80)
+        self.txs: list[Transaction] = parse_transactions(payload, offset, count)
+        self.offsets = []
+        for tx in self.txs:
+            self.offsets.append(offset)
+            offset += tx.size
+        self.size = offset
+
+    @property
+    def prev_hash(self) -> bytes:
+        return self.header[4:36]
+
+    def is_valid(self):
+        return merkle_root([tx.txid for tx in self.txs]) == self.header[36:68]
+
+    def __str__(self):
+        return "block: " + self.hash[::-1].hex() + " txs: " + str(len(self.txs)) + " size: " + str(self.size)
@@ -0,0 +1,148 @@
+import hashlib
+import struct
+
+from commands.tx import Transaction, merkle_root
+from utils import double_sha256, read_varint, varint_bytes
+
+MASK64 = 0xffffffffffffffff
+SHORT_ID_MASK = 0xffffffffffff  # short id to 6 bajtow
+
+
+def _rotl(x, b):
+    return ((x << b) | (x >> (64 - b))) & MASK64
+
+
+def siphash24(k0: int, k1: int, data: bytes) -> int:
+    """SipHash-2-4 as used by BIP152 short transaction ids."""
+    v0 = k0 ^ 0x736f6d6570736575
+    v1 = k1 ^ 0x646f72616e646f6d
+    v2 = k0 ^ 0x6c7967656e657261
+    v3 = k1 ^ 0x7465646279746573
+
+    def rounds(n):
+        nonlocal v0, v1, v2, v3
+        for _ in range(n):
+            v0 = (v0 + v1) & MASK64
+            v1 = _rotl(v1, 13) ^ v0
+            v0 = _rotl(v0, 32)
+            v2 = (v2 + v3) & MASK64
+            v3 = _rotl(v3, 16) ^ v2
+            v0 = (v0 + v3) & MASK64
+            v3 = _rotl(v3, 21) ^ v0
+            v2 = (v2 + v1) & MASK64
+            v1 = _rotl(v1, 17) ^ v2
+            v2 = _rotl(v2, 32)
+
+    full = len(data) // 8 * 8
+    for offset in range(0, full, 8):
+        m = int.from_bytes(data[offset:offset + 8], 'little')
+        v3 ^= m
+        rounds(2)
+        v0 ^= m
+    m = ((len(data) & 0xff) << 56) | int.from_bytes(data[full:], 'little')
+    v3 ^= m
+    rounds(2)
+    v0 ^= m
+    v2 ^= 0xff
+    rounds(4)
+    return v0 ^ v1 ^ v2 ^ v3
+
+
+class CompactBlock:
+    """cmpctblock payload (BIP152): header, nonce, short ids and prefilled transactions."""
+
+    def __init__(self, payload: bytes):
+        self.header = payload[:80]
+        self.hash = double_sha256(self.header)
+        nonce = payload[80:88]
+        key = hashlib.sha256(self.header + nonce).digest()
+        self.k0, self.k1 = struct.unpack_from('<QQ', key)
+
+        count, offset = read_varint(payload, 88)
+        self.short_ids = [int.from_bytes(payload[offset + 6 * i:offset + 6 * i + 6], 'little') for i in range(count)]
+        offset += 6 * count
+
+        count, offset = read_varint(payload, offset)
+        self.prefilled: list[tuple[int, Transaction]] = []
+        index = -1
+        for _ in range(count):
+            diff, offset = read_varint(payload, offset)
+            index += diff + 1
+            tx = Transaction(payload, offset)
+            offset += tx.size
+            self.prefilled.append((index, tx))
+
+    def short_id(self, wtxid: bytes) -> int:
+        return siphash24(self.k0, self.k1, wtxid) & SHORT_ID_MASK
+
+    def tx_count(self):
+        return len(self.short_ids) + len(self.prefilled)
+
+
+class PartialBlock:
+    """Block being rebuilt from a CompactBlock and the mempool.
+
+    Short ids of the whole mempool are computed once per block into a dict, so
+    matching is a single pass over the block's short ids. Ids that collide (in the
+    mempool or inside the block) are treated as missing and asked for with
+    getblocktxn, as are transactions we have not seen.
+    """
+
+    def __init__(self, compact: CompactBlock, mempool_txs):
+        self.compact = compact
+        self.txs: list[Transaction | None] = [None] * compact.tx_count()
+        for index, tx in compact.prefilled:
+            if index < len(self.txs):
+                self.txs[index] = tx
+
+        index_by_id: dict[int, Transaction | None] = {}
+        for tx in mempool_txs:
+            short_id = compact.short_id(tx.wtxid)
+            index_by_id[short_id] = None if short_id in index_by_id else tx
+
+        seen = set()
+        duplicated = {sid for sid in compact.short_ids if sid in seen or seen.add(sid)}
+        slots = (i for i, tx in enumerate(self.txs) if tx is None)
+        for short_id, slot in zip(compact.short_ids, slots):
+            if short_id not in duplicated:
+                self.txs[slot] = index_by_id.get(short_id)
+
+    @property
+    def hash(self) -> bytes:
+        return self.compact.hash
+
+    def missing(self) -> list[int]:
+        return [i for i, tx in enumerate(self.txs) if tx is None]
+
+    def is_complete(self):
+        return all(tx is not None for tx in self.txs)
+
+    def getblocktxn_payload(self) -> bytes:
+        indexes = self.missing()
+        payload = self.hash + varint_bytes(len(indexes))
+        previous = -1
+        for index in indexes:
+            payload += varint_bytes(index - previous - 1)
+            previous = index
+        return payload
+
+    def fill(self, blocktxn_payload: bytes) -> bool:
+        """Fills the missing slots from a blocktxn message; False if it does not match."""
+        if blocktxn_payload[:32] != self.hash:
+            return False
+        count, offset = read_varint(blocktxn_payload, 32)
+        missing = self.missing()
+        if count != len(missing):
+            return False
+        for index in missing:
+            tx = Transaction(blocktxn_payload, offset)
+            offset += tx.size
+            self.txs[index] = tx
+        return True
+
+    def is_valid(self):
+        """Merkle root check - catches a wrong mempool match (short id collision)."""
+        return merkle_root([tx.txid for tx in self.txs]) == self.compact.header[36:68]
+
+    def block_bytes(self) -> bytes:
+        return self.compact.header + varint_bytes(len(self.txs)) + b''.join(tx.raw for tx in self.txs)
@@ -0,0 +1,75 @@
+import struct
+
+from commands.version import SENDHEADERS_VERSION, SHORT_IDS_BLOCKS_VERSION, WTXID_RELAY_VERSION
+from constants import MAGIC_BYTES, PROTOCOL_VERSION
+from utils import build_message
+
+CMPCT_VERSION = 2  # BIP152 v2 (wtxid w short id)
+
+
+def negotiated_version(peer_version) -> int:
+    """Both sides speak the lower of the two protocol versions; features are gated on it."""
+    return min(PROTOCOL_VERSION, peer_version.version)
+
+
+def pre_verack_messages(peer_version, magic=MAGIC_BYTES) -> bytes:
+    """wtxidrelay (BIP339) and sendaddrv2 (BIP155) must be sent between version and verack."""
+    messages = b''
+    if negotiated_version(peer_version) >= WTXID_RELAY_VERSION:
+        messages += build_message("wtxidrelay", magic=magic)
+    messages += build_message("sendaddrv2", magic=magic)
+    return messages
+
+
+def sendcmpct_payload(high_bandwidth) -> bytes:
+    """high_bandwidth: the peer pushes new blocks as cmpctblock right away instead of announcing them."""
+    return struct.pack('<?Q', high_bandwidth, CMPCT_VERSION)
+
+
+def supports_cmpct(peer_version) -> bool:
+    return negotiated_version(peer_version) >= SHORT_IDS_BLOCKS_VERSION
+
+
+def post_verack_messages(peer_version, high_bandwidth=False, magic=MAGIC_BYTES) -> bytes:
+    """sendheaders (BIP130) and sendcmpct (BIP152) go after verack, as in Bitcoin Core."""
+    messages = b''
+    version = negotiated_version(peer_version)
+    if version >= SENDHEADERS_VERSION:
+        messages += build_message("sendheaders", magic=magic)
+    if version >= SHORT_IDS_BLOCKS_VERSION:
+        messages += build_message("sendcmpct", sendcmpct_payload(high_bandwidth), magic)
+    return messages
+
+
+class Features:
+    """Features the peer asked for with its own negotiation messages."""
+
+    def __init__(self):
+        self.wtxidrelay = False
+        self.sendaddrv2 = False
+        self.sendheaders = False
+        self.cmpct_version = None
+        self.cmpct_high_bandwidth = False
+
+    def update(self, command, payload) -> bool:
+        """Records a negotiation message; returns False for any other command."""
+        if command == "wtxidrelay":
+            self.wtxidrelay = True
+        elif command == "sendaddrv2":
+            self.sendaddrv2 = True
+        elif command == "sendheaders":
+            self.sendheaders = True
+        elif command == "sendcmpct":
+            if len(payload) < 9:
+                return True
+            high_bandwidth, version = struct.unpack_from('<?Q', payload)
+            if version == CMPCT_VERSION:
+                self.cmpct_version = version
+                self.cmpct_high_bandwidth = high_bandwidth
+        else:
+            return False
+        return True
+
+    def __str__(self):
+        return (f"wtxidrelay={self.wtxidrelay} sendaddrv2={self.sendaddrv2} sendheaders={self.sendheaders} "
+                f"sendcmpct={self.cmpct_version} high_bandwidth={self.cmpct_high_bandwidth}")
@@ -1,15 +1,139 @@
 import logging
+import struct
+
+from constants import BYTE_IN_CHARS, GENESIS_HASH, POW_LIMIT
+from utils import double_sha256, MalformedMessage
+
+
+def header_target(header: bytes) -> int | None:
+    """Target decoded from the header's nBits; None for a negative, zero or overflowing one."""
+    bits = struct.unpack_from('<I', header, 72)[0]
+    exponent, mantissa = bits >> 24, bits & 0x007fffff
+    if mantissa == 0 or bits & 0x00800000:
+        return None
+    target = mantissa << 8 * (exponent - 3) if exponent > 3 else mantissa >> 8 * (3 - exponent)
+    if target == 0 or target >> 256:
+        return None
+    return target
+
+
+def header_work(header: bytes) -> int:
+    """Expected number of hashes behind a header, from its nBits target (as in Bitcoin Core)."""
+    target = header_target(header)
+    return 0 if target is None else (1 << 256) // (target + 1)
+
+
+def locator_heights(tip_height) -> list[int]:
+    """Last 10 heights, then exponentially sparser ones back to genesis (block locator)."""
+    heights = []
+    height = tip_height
+    step = 1
+    while height > 0:
+        heights.append(height)
+        if len(heights) >= 10:
+            step *= 2
+        height -= step
+    heights.append(0)
+    return heights
 
-from constants import BYTE_IN_CHARS
 
 class Headers:
-    def __init__(self):
+    def __init__(self, genesis_hash=GENESIS_HASH, pow_limit=POW_LIMIT):
         self.logger = logging.getLogger('bitcoin')
+        self.pow_limit = pow_limit
         self.last_block_hash = None
+        # lancuch naglowkow: hashes[wysokosc] = hash bloku (kolejnosc wewnetrzna)
+        self.hashes: list[bytes] = [bytes.fromhex(genesis_hash)[::-1]]
+        self.heights: dict[bytes, int] = {self.hashes[0]: 0}
+        # wszystkie znane naglowki, takze z bocznych galezi: hash -> (hash rodzica, wysokosc, laczna praca)
+        self.index: dict[bytes, tuple[bytes | None, int, int]] = {self.hashes[0]: (None, 0, 0)}
+        # wywolywane z wysokoscia rozwidlenia, gdy naglowki zastapia czesc lancucha
+        self.reorg_listeners = []
+
+    def tip_height(self):
+        return len(self.hashes) - 1
+
+    def height_of(self, block_hash: bytes):
+        return self.heights.get(block_hash)
+
+    def locator(self) -> list[bytes]:
+        return [self.hashes[h] for h in locator_heights(self.tip_height())]
+
+    def knows(self, block_hash: bytes) -> bool:
+        return block_hash in self.index
+
+    def parent_of(self, block_hash: bytes) -> bytes | None:
+        """Parent hash of any known header (side branches included), None if unknown."""
+        entry = self.index.get(block_hash)
+        return None if entry is None else entry[0]
+
+    def tip_work(self):
+        return self.index[self.hashes[-1]][2]
+
+    def connect(self, header: bytes, block_hash: bytes | None = None) -> int | None:
+        """Adds an 80-byte header; returns its height on the active chain, or None.
+
+        None means the parent is unknown or the header sits on a side branch. A
+        side branch is kept and becomes active (reorg, reorg_listeners are called
+        with the fork height) only once it has more cumulative work than the tip;
+        on equal work the branch seen first stays, as in Bitcoin Core. A header
+        whose hash does not meet its own nBits target, or whose target is above
+        the network's pow_limit, raises MalformedMessage - otherwise an unmined
+        header with easy bits could claim any amount of work.
+        """
+        if block_hash is None:
+            block_hash = double_sha256(header)
+        if block_hash in self.index:
+            return self.heights.get(block_hash)
+        target = header_target(header)
+        if target is None or target > self.pow_limit:
+            raise MalformedMessage("block header", f"invalid nBits in {block_hash[::-1].hex()}")
+        if int.from_bytes(block_hash, 'little') > target:
+            raise MalformedMessage("block header", f"{block_hash[::-1].hex()} does not meet its target")
+        parent_hash = header[4:36]
+        parent = self.index.get(parent_hash)
+        if parent is None:
+            return None
+        height = parent[1] + 1
+        work = parent[2] + header_work(header)
+        self.index[block_hash] = (parent_hash, height, work)
+        if parent_hash == self.hashes[-1]:
+            self.hashes.append(block_hash)
+            self.heights[block_hash] = height
+            return height
+        if work <= self.tip_work():
+            self.logger.debug(f"headers: side branch at height {height}\n")
+            return None
+        self.reorg(block_hash)
+        return height
+
+    def reorg(self, tip_hash: bytes) -> None:
+        """Makes the branch ending at tip_hash the active chain."""
+        branch = []
+        block_hash = tip_hash
+        while block_hash not in self.heights:
+            branch.append(block_hash)
+            block_hash = self.index[block_hash][0]
+        fork_height = self.heights[block_hash] + 1
+        for stale in self.hashes[fork_height:]:
+            del self.heights[stale]
+        del self.hashes[fork_height:]
+        for height, block_hash in enumerate(reversed(branch), fork_height):
+            self.hashes.append(block_hash)
+            self.heights[block_hash] = height
+        self.logger.info("Reorg: chain replaced from height " + str(fork_height))
+        for listener in self.reorg_listeners:
+            listener(fork_height)
 
     def unpack_block_headers(self, data):
+        block_headers = self.parse_block_headers(data)
+        self.accept(block_headers)
+        return block_headers
+
+    # naglowki jako hex, bez zmiany stanu - mozna wywolac w innym watku/procesie
+    @staticmethod
+    def parse_block_headers(data):
         varint = str(data)[:2]
-        self.logger.info("varint: " + str(varint) + "\n")
         block_headers_amount = 1 * BYTE_IN_CHARS
         if varint == "fd":
             block_headers_amount = 3 * BYTE_IN_CHARS
@@ -26,5 +150,14 @@ class Headers:
             header_81 = block_headers_list[i:i + 81 * BYTE_IN_CHARS]
             header_80 = header_81[:80 * BYTE_IN_CHARS]  # ostatni bajt zawsze 0 odcinamy
             block_headers.append(header_80)
+        return block_headers
+
+    # hashes: opcjonalnie policzone wczesniej hashe naglowkow
+    def accept(self, block_headers, hashes=None):
+        self.logger.info("headers: " + str(len(block_headers)) + "\n")
+        if not block_headers:
+            return
+        for i, header in enumerate(block_headers):
+            self.connect(bytes.fromhex(header), None if hashes is None else hashes[i])
         self.last_block_hash = block_headers[-1]
         print(self.last_block_hash + "\n")
\ No newline at end of file
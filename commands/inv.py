@@ -1,6 +1,15 @@
 from constants import BYTE_IN_CHARS
 import logging
 
+MSG_TX = 1
+MSG_BLOCK = 2
+MSG_FILTERED_BLOCK = 3
+MSG_CMPCT_BLOCK = 4
+MSG_WTX = 5
+MSG_WITNESS_FLAG = 1 << 30
+MSG_WITNESS_TX = MSG_TX | MSG_WITNESS_FLAG
+MSG_WITNESS_BLOCK = MSG_BLOCK | MSG_WITNESS_FLAG
+
 class InvVector:
     def __init__(self, data):
         inv_vector_tuple = self.unpack(data)
@@ -27,6 +36,9 @@ class InvVector:
         elif uint32_t == "04000000":
             name = "MSG_CMPCT_BLOCK"
             return [name, data]
+        elif uint32_t == "05000000":
+            name = "MSG_WTX"  # po wtxidrelay (BIP339) transakcje sa oglaszane po wtxid
+            return [name, data]
         elif uint32_t == "01000040":
             name = "MSG_WITNESS_TX"
             return [name, data]
@@ -37,7 +49,7 @@ class InvVector:
             name = "MSG_FILTERED_WITNESS_BLOCK"
             return [name, data]
         print("something went wrong! inv.py:36")
-        return None
+        return ["UNKNOWN", data]
 
 
 class Inv:
@@ -62,8 +74,12 @@ class Inv:
         inv_vector_list = []
         for inv_vector in inv_vectors:
             inv_vector_list.append(InvVector(inv_vector))
+        self.track(inv_vector_list)
+        return inv_vector_list
+
+    # zapamietuje pierwsza oglaszana transakcje (dla trybu GETDATA_TX)
+    def track(self, inv_vector_list):
         for inv_vector in inv_vector_list:
             if inv_vector.name == "MSG_TX":
                 self.transaction = inv_vector
                 break
-        return inv_vector_list
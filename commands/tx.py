@@ -0,0 +1,77 @@
+import struct
+
+from utils import double_sha256, read_varint
+
+
+class Transaction:
+    """Parsed tx; txid/wtxid are in internal byte order (reverse for display)."""
+    __slots__ = ("raw", "txid", "wtxid", "inputs", "outputs", "size")
+
+    def __init__(self, data: bytes, offset: int = 0):
+        start = offset
+        segwit = data[offset + 4] == 0 and data[offset + 5] == 1
+        offset += 6 if segwit else 4
+
+        ins_start = offset
+        count, offset = read_varint(data, offset)
+        self.inputs = []
+        for _ in range(count):
+            prev_txid = data[offset:offset + 32]
+            vout = struct.unpack_from('<I', data, offset + 32)[0]
+            script_len, offset = read_varint(data, offset + 36)
+            offset += script_len + 4  # script + sequence
+            self.inputs.append((prev_txid, vout))
+
+        count, offset = read_varint(data, offset)
+        self.outputs = []
+        for _ in range(count):
+            value = struct.unpack_from('<q', data, offset)[0]
+            script_len, offset = read_varint(data, offset + 8)
+            self.outputs.append((value, data[offset:offset + script_len]))
+            offset += script_len
+        ins_end = offset
+
+        if segwit:
+            for _ in range(len(self.inputs)):
+                items, offset = read_varint(data, offset)
+                for _ in range(items):
+                    item_len, offset = read_varint(data, offset)
+                    offset += item_len
+        offset += 4  # locktime
+        if offset > len(data):
+            raise ValueError("truncated transaction")
+
+        self.raw = bytes(data[start:offset])
+        self.size = offset - start
+        self.wtxid = double_sha256(self.raw)
+        if segwit:
+            # txid liczymy z serializacji bez markera, flagi i witness
+            stripped = data[start:start + 4] + data[ins_start:ins_end] + data[offset - 4:offset]
+            self.txid = double_sha256(stripped)
+        else:
+            self.txid = self.wtxid
+
+    def is_coinbase(self):
+        return len(self.inputs) == 1 and self.inputs[0] == (bytes(32), 0xffffffff)
+
+    def __str__(self):
+        return "txid: " + self.txid[::-1].hex() + " inputs: " + str(len(self.inputs)) + \
+            " outputs: " + str(len(self.outputs)) + " size: " + str(self.size)
+
+
+def parse_transactions(data: bytes, offset: int, count: int) -> list[Transaction]:
+    txs = []
+    for _ in range(count):
+        tx = Transaction(data, offset)
+        offset += tx.size
+        txs.append(tx)
+    return txs
+
+
+def merkle_root(txids: list[bytes]) -> bytes:
+    level = list(txids)
+    while len(level) > 1:
+        if len(level) % 2 == 1:
+            level.append(level[-1])
+        level = [double_sha256(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+    return level[0] if level else bytes(32)
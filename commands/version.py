@@ -1,38 +1,64 @@
+import os
+import struct
 import time
-import constants as cons
-
-from utils import append_zeros_right, reverse_hex, del_colons, del_0x, checksum_f, str_to_hex, int_to_byte_str, \
-    count_payload
-
-def get_version(node):
-    p_ver = int_to_byte_str(70014, 4)  # protocol version
-    serv = int_to_byte_str(0, 8)  # services
-    t = int(time.time())
-    time_ = int_to_byte_str(t, 8)  # time
-    r_serv = int_to_byte_str(0, 8)  # remote services
-    remote_ip = del_colons(node.host_v6)  # remote ip
-    r_port = del_0x(hex(int(node.port)))  # remote port
-    l_serv = int_to_byte_str(0, 8)  # local services
-    l_ip = del_colons(cons.local.get("LOCALHOST_V6"))  # local ip
-    l_port = del_0x(hex(int(cons.local.get("PORT"))))  # local port
-    nonce = int_to_byte_str(0, 8)  # nonce
-    compact = "00"  # user agent
-    last_block = int_to_byte_str(0, 4)  # remote services
-
-    payload = p_ver + serv + time_ + r_serv + remote_ip + r_port + l_serv + l_ip + l_port + nonce + compact + last_block
-
-    # message header
-    m_bytes = 'f9beb4d9'  # magic bytes
-    c = "version"
-    command = str_to_hex(c, 12)
-    size = count_payload(payload, 4)
-    checksum = checksum_f(payload)
-
-    header = m_bytes + command + size + checksum
-
-    # combined
-    version_message = header + payload
-    return version_message
+from ipaddress import IPv6Address
+
+from constants import MAGIC_BYTES, PROTOCOL_VERSION
+from utils import build_message, read_varint, varint_bytes
+
+USER_AGENT = "/browser_for_bitcoin_p2p:0.1/"
+
+NODE_NETWORK = 1
+NODE_WITNESS = 1 << 3
+
+# od tych wersji protokolu peer rozumie dana wiadomosc
+SENDHEADERS_VERSION = 70012
+SHORT_IDS_BLOCKS_VERSION = 70014
+WTXID_RELAY_VERSION = 70016
+
+
+def net_addr(services, host_v6, port):
+    ip = IPv6Address(host_v6).packed if host_v6 else bytes(16)
+    return struct.pack('<Q', services) + ip + struct.pack('>H', int(port))
+
+
+def build_version(node, start_height=0, relay=True, services=0, nonce=None, user_agent=USER_AGENT,
+                  magic=MAGIC_BYTES) -> bytes:
+    if nonce is None:
+        nonce = int.from_bytes(os.urandom(8), 'little')
+    agent = user_agent.encode('utf-8')
+    payload = (struct.pack('<iQq', PROTOCOL_VERSION, services, int(time.time()))
+               + net_addr(0, node.host_v6, node.port)  # adres odbiorcy
+               + net_addr(services, None, 0)  # nasz adres - jak w Bitcoin Core wysylamy zera
+               + struct.pack('<Q', nonce)
+               + varint_bytes(len(agent)) + agent
+               + struct.pack('<i?', start_height, relay))
+    return build_message("version", payload, magic)
+
+
+class Version:
+    """Peer's version message."""
+
+    def __init__(self, payload: bytes):
+        self.version, self.services, self.timestamp = struct.unpack_from('<iQq', payload, 0)
+        self.addr_recv = payload[20:46]
+        self.addr_from = payload[46:72]
+        self.nonce = struct.unpack_from('<Q', payload, 72)[0]
+        agent_len, offset = read_varint(payload, 80)
+        self.user_agent = payload[offset:offset + agent_len].decode('utf-8', 'replace')
+        offset += agent_len
+        self.start_height = struct.unpack_from('<i', payload, offset)[0]
+        offset += 4
+        # pole relay jest opcjonalne (BIP37), brak oznacza True
+        self.relay = payload[offset] != 0 if len(payload) > offset else True
+
+    def has_service(self, flag):
+        return bool(self.services & flag)
+
+    def __str__(self):
+        return (f"version: {self.version} services: {self.services:#x} user agent: {self.user_agent} "
+                f"start height: {self.start_height} relay: {self.relay}")
+
 
 if __name__ == '__main__':
     print(time)
@@ -1,30 +1,91 @@
-import socket
+import functools
 import logging
+import select
 import socket
 import struct
+import threading
+import time
 
+from commands import getblocks, getheaders
 from commands.addr import Addr
-from commands.getblocks import getblocks_message
-from commands.getheaders import getheaders_message, get_msg_fields
+from commands.addr_store import AddrStore
+from commands.block import Block
+from commands.cmpctblock import CompactBlock, PartialBlock
 from commands.headers import Headers
-from commands.inv import Inv
-from commands.verack import verack_header
-from commands.version import get_version
+from commands.inv import Inv, MSG_CMPCT_BLOCK, MSG_WTX, MSG_WITNESS_TX, MSG_WITNESS_BLOCK
+from commands.tx import Transaction
+from commands.features import Features, pre_verack_messages, post_verack_messages, sendcmpct_payload, supports_cmpct
+from commands.version import Version, build_version
+from mempool import Mempool
+from block_walk import BlockHashWalk
+from cache import LRUCache, TTLCache
 from mode import Mode
-from utils import checksum_f, bytes_to_int, bytes_to_str, \
-    bytes_to_hex_str, str_to_hex, count_payload
+from network import MAINNET
+from outbound import OutboundWriter
+from peer_guard import PeerGuard, OVERSIZED_SCORE, MALFORMED_SCORE, TOO_MANY_ITEMS_SCORE
+from utils import checksum_f, \
+    bytes_to_hex_str, str_to_hex, count_payload, read_frame, double_sha256, varint_bytes, read_varint, OversizedMessage, \
+    checksum_bytes
 from commands.addr_utils import is_sensible_addr, print_addr
+from constants import MAX_ADDR_SIZE, MAX_HEADERS_RESULTS, MAX_INV_SIZE
+from export import addr_record, inv_record, header_record, tx_record, block_record
+
+
+# inv/headers z wieksza liczba blokow to odpowiedz na getblocks/getheaders, nie ogloszenie nowego bloku
+MAX_BLOCKS_TO_ANNOUNCE = 8
 
+# tyle ostatnich zadan getdata pamietamy, zeby po zerwaniu polaczenia moc o nie poprosic innego peera
+MAX_IN_FLIGHT = 10_000
+
+# obslugiwane od razu w watku czytajacym, reszta w kolejnosci odbioru przez kolejke offloadera
+CONTROL_COMMANDS = ("ping", "pong")
 
 
 class Communication:
-    def __init__(self, NODE, MODE = Mode.IDLE):
+    def __init__(self, NODE, MODE = Mode.IDLE, network=None):
         self.node = NODE
         self.logger = logging.getLogger('bitcoin')
         self.MODE = MODE
         self.addr = Addr()
+        # magic, port, genesis i sciezki plikow sieci (network.NETWORKS)
+        self.network = network or MAINNET
+        self.addr_store = AddrStore(self.network.path("addresses.json"), ban_path=self.network.path("banned.json"),
+                                    default_port=self.network.port)
         self.inv = Inv()
-        self.headers = Headers()
+        self.headers = Headers(self.network.genesis_hash, self.network.pow_limit)
+        self.pool = None
+        self.connection = None
+        self.start_height = 0
+        self.mempool = Mempool()
+        self.partial_blocks: dict[bytes, PartialBlock] = {}
+        self.unconnecting_headers = 0
+        self.recent_blocks = LRUCache(64)  # hashe ostatnio obsluzonych blokow, kolejny cmpctblock pomijamy
+        self.follow_tip = False
+        # hashe z inv, o ktore juz poprosilismy; mozna wspoldzielic miedzy polaczeniami
+        self.seen_inv = TTLCache(100_000, ttl=120.0, name="inv seen")
+        # hashe wyslane w getdata, na ktore nie przyszla jeszcze odpowiedz (dict jako zbior z kolejnoscia)
+        self.in_flight: dict[bytes, None] = {}
+        self.last_block: bytes | None = None
+        self.latency_monitor = None
+        self.tx_index = None
+        self.block_walk: BlockHashWalk | None = None
+        self.offloader = None
+        self.events = None  # export.EventBus z podpietymi sinkami
+        self.writer: OutboundWriter | None = None
+        self.guard: PeerGuard | None = None
+        self.send_rate = None  # bajty/s do tego peera, None = bez limitu
+        self.send_bucket = None  # wspolny TokenBucket (limit globalny)
+        self.reading_client = None  # gniazdo petli read_in_loop; wiadomosci z kolejki od innego sa nieaktualne
+        self.last_received = time.monotonic()  # ostatnia wiadomosc od peera, do wykrywania martwych polaczen
+        # handle_message wolane jest tez z watku offloadera
+        self.state_lock = threading.RLock()
+        self.reset_handshake()
+
+    def peer_name(self):
+        return "?" if self.node is None else f"{self.node.host_v4}:{self.node.port}"
+
+    def exit(self):
+        self.MODE = Mode.EXIT
 
     def get_mode(self):
         return self.MODE
@@ -35,10 +96,72 @@ class Communication:
     def set_node(self, NODE):
         self.node = NODE
 
+    def close(self):
+        # zapisuje zalegle adresy z kolejki na dysk
+        self.addr_store.close()
+        if self.offloader is not None:
+            # najpierw dostarcza zdekodowane bloki, dopiero potem zamyka sinki eksportu i indeks
+            self.offloader.close()
+        if self.events is not None:
+            self.events.close()
+        if self.writer is not None:
+            self.writer.close()
+        if self.tx_index is not None:
+            self.tx_index.close()
+
     def disconnect(self, client):
+        if self.writer is not None and self.writer.client is client:
+            self.writer.close()
         client.close()
         print("Connection closed...: ")
 
+    def publish(self, kind, records) -> None:
+        """records: iterable of record dicts, consumed only if some sink listens to kind."""
+        if self.events is None or not self.events.wants(kind):
+            return
+        now = time.time()
+        peer = self.peer_name()
+        for record in records:
+            self.events.publish(kind, {"time": now, "peer": peer, **record})
+
+    def writer_for(self, client) -> OutboundWriter:
+        """Outbound writer of the socket, created on first use (pooled connections bring their own)."""
+        if self.writer is None or self.writer.client is not client:
+            if self.writer is not None:
+                self.writer.close(flush_timeout=0)
+            self.writer = OutboundWriter(client, rate=self.send_rate, global_bucket=self.send_bucket,
+                                         magic=self.network.magic)
+        return self.writer
+
+    def guard_for(self, client) -> PeerGuard:
+        """Misbehavior score and inbound limits of the socket, fresh for every new connection."""
+        if self.guard is None or self.guard.client is not client:
+            self.guard = PeerGuard(client, self.node, self.addr_store)
+        return self.guard
+
+    def read_message(self, client):
+        """read_frame that bans a peer announcing an oversized payload; None means the connection is gone."""
+        try:
+            return read_frame(client, self.network.magic)
+        except OversizedMessage as e:
+            self.guard_for(client).misbehaving(OVERSIZED_SCORE, str(e))
+            self.cut_off(client)
+            return None
+
+    def cut_off(self, client) -> None:
+        # po shutdown odczyt zwroci EOF i petla pojdzie zwykla sciezka zerwanego polaczenia
+        self.logger.info("Disconnecting " + self.peer_name())
+        try:
+            client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def send(self, client, command, payload=b'') -> bool:
+        return self.writer_for(client).send(command, payload)
+
+    def send_raw(self, client, message) -> bool:
+        return self.writer_for(client).send_raw(message)
+
     def connect(self) -> socket.socket:
         client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         client.connect((self.node.host_v4, self.node.port))
@@ -47,9 +170,11 @@ class Communication:
 
     def connect_until_success(self, max_tries=20, timeout=3):
         for _ in range(max_tries):
-            node = self.addr.draw()
+            node = self.addr.draw(self.addr_store.path, self.network.port)
             if node is None or node.host_v4 is None or node.host_v6 is None:
                 continue
+            if self.addr_store.is_banned(node.host_v4):
+                continue
 
             self.node = node
             client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -103,244 +228,610 @@ class Communication:
             self.logger.error(f"Błąd podczas dekodowania payloadu: {e}")
 
     def send_version(self, client) -> None:
-        version = bytes.fromhex(get_version(self.node))
-        client.send(version)
+        self.reset_handshake()
+        version = build_version(self.node, start_height=self.start_height, magic=self.network.magic)
+        self.send_raw(client, version)
         print("Version sent: ")
         self.logger.debug("+++++++++++++++++++++++++++++++++++++++++ Send version +++++++++++++++++++++++++++++++++++++++++\n")
         print(version)
 
     def read_version(self, client) -> None:
         try:
-            magic_bytes = client.recv(4)
-            command = client.recv(12)
-            size = client.recv(4)
-            checksum = client.recv(4)
-
-            size_dec = bytes_to_int(size, False)
-            payload = client.recv(size_dec)
+            frame = self.read_until(client, "version")
+            if frame is None:
+                print("Connection closed during the handshake.")
+                return
+            command_dec, payload, checksum = frame
+            if not self.accept_version(client, payload):
+                print("Malformed version message, disconnected.")
+                return
 
             self.logger.debug("======================================= Read version =============================================\n")
-            self.logger.debug("magic_bytes: " + str(magic_bytes.hex()) + "\n")
-            self.logger.debug("command: " + bytes_to_str(command) + "\n")
-            self.logger.debug("size: " + str(size_dec) + "\n")
+            self.logger.debug("command: " + command_dec + "\n")
+            self.logger.debug("size: " + str(len(payload)) + "\n")
             self.logger.debug("checksum: " + bytes_to_hex_str(checksum) + "\n")
             self.logger.debug("payload: " + bytes_to_hex_str(payload) + "\n")
         except socket.timeout:
             print("Node nie odpowiedział w czasie 10 sekund.")
 
     def read_verack(self, client) -> None:
-        magic_bytes = client.recv(4)
-        command = client.recv(12)
-        size = client.recv(4)
-        checksum = client.recv(4)
+        frame = self.read_until(client, "verack")
+        if frame is None:
+            print("Connection closed during the handshake.")
+            return
+        command_dec, payload, checksum = frame
 
         self.logger.debug("======================================= Read verack =============================================\n")
-        self.logger.debug("magic_bytes: " + str(magic_bytes.hex()) + "\n")
-        self.logger.debug("command: " + bytes_to_str(command) + "\n")
-        self.logger.debug("size: " + str(bytes_to_int(size, False)) + "\n")
+        self.logger.debug("command: " + command_dec + "\n")
+        self.logger.debug("size: " + str(len(payload)) + "\n")
         self.logger.debug("checksum: " + bytes_to_hex_str(checksum) + "\n")
-        # payload = client.recv(size_dec)
-        # print(str(payload))
+        self.verack_received = True
+        self.finish_handshake(client)
 
     def send_verack(self, client) -> None:
-        verack = bytes.fromhex(verack_header)
-        client.send(verack)
+        # wtxidrelay i sendaddrv2 musza byc wyslane przed naszym verack
+        if self.peer_version is not None:
+            self.send_raw(client, pre_verack_messages(self.peer_version, magic=self.network.magic))
+        self.send(client, "verack")
         self.logger.debug("======================================= Send verack =============================================\n")
-        self.logger.debug("verack: " + str(verack) + "\n")
+        self.logger.debug("verack sent\n")
+        self.verack_sent = True
+        self.finish_handshake(client)
+
+    def accept_version(self, client, payload) -> bool:
+        """Parses the peer's version; a truncated one is scored as malformed and the connection cut off."""
+        try:
+            self.peer_version = Version(payload)
+        except (struct.error, IndexError) as e:
+            self.logger.info("Malformed version message from " + self.peer_name() + ": " + str(e))
+            self.guard_for(client).misbehaving(MALFORMED_SCORE, "malformed version")
+            self.cut_off(client)
+            return False
+        self.logger.info("Peer " + str(self.peer_version))
+        return True
+
+    def reset_handshake(self):
+        self.peer_version = None
+        self.features = Features()
+        self.verack_sent = False
+        self.verack_received = False
+        self.negotiated = False
+
+    def read_until(self, client, command):
+        """Reads frames until the given command, recording negotiation messages on the way."""
+        while True:
+            frame = self.read_message(client)
+            if frame is None or frame[0] == command:
+                return frame
+            if not self.features.update(frame[0], frame[1]):
+                self.logger.debug("handshake: skipping " + frame[0] + "\n")
+
+    def finish_handshake(self, client):
+        """After both veracks asks the peer to push headers (BIP130) and compact blocks (BIP152)."""
+        if self.negotiated or not (self.verack_sent and self.verack_received) or self.peer_version is None:
+            return
+        # high bandwidth (peer wypycha kazdy blok jako cmpctblock) tylko gdy sledzimy tip
+        self.send_raw(client, post_verack_messages(self.peer_version, self.follow_tip, magic=self.network.magic))
+        self.negotiated = True
+        self.logger.debug("negotiated features: " + str(self.features) + "\n")
+
+    def handshake(self, client) -> bool:
+        """Sends version and reads until both the peer's version and verack arrived.
+
+        Unlike the manual send/read sequence this does not assume the peer sends
+        nothing else in between. Returns False when the peer closed the connection.
+        """
+        self.reset_handshake()
+        self.send_raw(client, build_version(self.node, start_height=self.start_height, magic=self.network.magic))
+        self.logger.debug("+++++++++++++++++++++++++++++++++++++++++ Send version +++++++++++++++++++++++++++++++++++++++++\n")
+        while not (self.peer_version is not None and self.verack_received):
+            frame = self.read_message(client)
+            if frame is None:
+                return False
+            command_dec, payload, _ = frame
+            self.logger.debug("handshake: " + command_dec + "\n")
+            if command_dec == "version":
+                if not self.accept_version(client, payload):
+                    return False
+                self.send_verack(client)
+            elif command_dec == "verack":
+                self.verack_received = True
+            else:
+                self.features.update(command_dec, payload)
+        self.finish_handshake(client)
+        return True
+
+    def reconnect(self, client):
+        """Called when the peer closed the connection; returns a new socket or None."""
+        if self.pool is None or self.connection is None or self.MODE is Mode.EXIT:
+            return None
+        self.pool.release(self.connection, broken=True)
+        return self.borrow(self.pool)
+
+    def borrow(self, pool, timeout=30):
+        """Takes a handshaked connection from the pool and makes it the current one."""
+        self.pool = pool
+        self.connection = pool.acquire(timeout)
+        if self.connection is None:
+            return None
+        self.node = self.connection.node
+        self.peer_version = self.connection.peer_version
+        self.features = self.connection.features
+        self.writer = self.connection.writer
+        self.last_received = time.monotonic()
+        if self.follow_tip:
+            # pula robi handshake w trybie low bandwidth
+            self.request_high_bandwidth(self.connection.client)
+        print(f"Using pooled connection to {self.node}")
+        return self.connection.client
 
     def read_in_loop(self, client) -> None:
-        magic_bytes = 'f9beb4d9'
+        self.reading_client = client
         while self.MODE is not Mode.EXIT:
-            buffer = ''
-            while True:
-                byte = client.recv(1)
-                if byte == b'\x00':
-                    print("Read null byte from the socket.")
+            try:
+                # czekamy na dane najwyzej sekunde, zeby ustawiony tryb byl obsluzony bez czekania na wiadomosc
+                if not select.select([client], [], [], 1.0)[0]:
+                    self.handle_mode(client)
+                    continue
+                frame = self.read_message(client)
+            except socket.timeout:
+                self.handle_mode(client)
+                continue
+            except (OSError, ValueError) as e:
+                self.logger.info("Socket error: " + str(e))
+                frame = None
+
+            if frame is None:
+                print("Connection lost.")
+                # pod state_lock: zaden handler z kolejki nie wysyla w trakcie podmiany polaczenia
+                with self.state_lock:
+                    self.forget_in_flight()
+                    client = self.reconnect(client)
+                    self.reading_client = client
+                if client is None:
                     return
-                buffer += byte.hex()
-
-                if len(buffer) == 8: # 8 hex chars == 4 bytes
-                    if buffer == 'f9beb4d9':
-                        command = client.recv(12)
-                        size = client.recv(4)
-                        checksum = client.recv(4)
-
-                        command_dec = bytes_to_str(command)
-                        size_dec = bytes_to_int(size, False)
-                        payload = client.recv(size_dec)
-                        payload_hex = bytes_to_hex_str(payload)
-
-                        self.logger.debug("======================================= any command =============================================\n")
-                        self.logger.debug("command: " + command_dec + "\n")
-                        self.logger.debug("size: " + str(size_dec) + "\n")
-                        self.logger.debug("checksum: " + bytes_to_hex_str(checksum) + "\n")
-                        self.logger.debug("payload: " + payload_hex + "\n")
-
-                        if command_dec == "ping":
-                            self.logger.info("Ping command received.")
-                            command = "pong"
-
-                            command_hex = str_to_hex(command, 12)
-                            size = count_payload(payload_hex, 4)
-                            checksum = checksum_f(payload_hex)
-                            self.logger.info(command_hex + "\n")
-                            message = magic_bytes + command_hex + size + checksum + payload_hex
-
-                            client.send(bytes.fromhex(message))
-                            self.logger.info("Answering with command pong.")
-
-                        if self.MODE is Mode.GETADDR:
-                            self.MODE = Mode.IDLE
-                            command = 'getaddr'
-
-                            command_hex = str_to_hex(command, 12)
-                            size = count_payload(payload_hex, 4)
-                            checksum = checksum_f(payload.hex())
-                            message = magic_bytes + command_hex + size + checksum + payload_hex
-
-                            client.send(bytes.fromhex(message))
-                            self.logger.debug("+++++++++++++++++++++++++++++++++++++++++ getaddr +++++++++++++++++++++++++++++++++++++++++\n")
-                            self.logger.info("getaddr: asking for information about known active peers.")
-
-                        if command_dec == "addr":
-                            self.MODE = Mode.IDLE
-                            a_list = self.addr.unpack_addresses(payload_hex)
-                            self.addr.save(a_list)
-
-                            #for addr in a_list:
-                            #    print(addr)
-
-                            printed = set()
-
-                            for addr in a_list:
-                                if not is_sensible_addr(addr):
-                                    continue
-
-                                key = (addr.ip, addr.port)
-                                if key in printed:
-                                    continue
-
-                                printed.add(key)
-                                print_addr(addr)
-
-
-
-                        if command_dec == "inv":
-                            command = "inv"
-
-                            command_hex = str_to_hex(command, 12)
-                            size = count_payload(payload_hex, 4)
-                            checksum = checksum_f(payload_hex)
-
-                            self.inv.unpack_transactions(payload_hex)
-
-                            self.logger.debug("======================================= inv =============================================\n")
-                            self.logger.debug("command: " + command + "\n")
-                            self.logger.debug("size: " + str(size) + "\n")
-                            self.logger.debug("checksum: " + str(checksum) + "\n")
-                            self.logger.debug("payload: " + payload_hex + "\n")
-                            # command = "getdata"
-                            # command_hex = str_to_hex(command, 12)
-                            # inv_vector_list = self.inv.unpack_transactions(payload_hex)
-                            # if not inv_vector_list:
-                            #     print("Brak transakcji w inv_vector_list")
-                            #     continue
-                            # while True:
-                            #     inv_vector = random.choice(inv_vector_list)
-                            #     if inv_vector.name == "MSG_TX":
-                            #         payload_hex = "01" + inv_vector.hash
-                            #         break
-                            # size = count_payload(payload_hex, 4)
-                            # checksum = checksum_f(payload_hex)
-                            #
-                            # self.logger.debug("======================================= getdata =============================================\n")
-                            # self.logger.debug("command: " + command + "\n")
-                            # self.logger.debug("size: " + str(size) + "\n")
-                            # self.logger.debug("checksum: " + str(checksum) + "\n")
-                            # self.logger.debug("payload: " + payload_hex + "\n")
-                            #
-                            # # odpowiedz dowolnym getdata zeby node nie rozlaczal
-                            # message = magic_bytes + command_hex + size + checksum + payload_hex
-                            # self.logger.debug("spraawdzenie: " + str(bytes.fromhex(message)))
-                            # client.send(bytes.fromhex(message))
-
-                        if self.MODE is Mode.GETDATA_TX:
-                            self.MODE = Mode.IDLE
-                            command = "getdata"
-                            command_hex = str_to_hex(command, 12)
-
-                            payload_hex = "01" + self.inv.transaction.hash
-                            
-                            size_protocol = count_payload(payload_hex, 4)
-                            checksum = checksum_f(payload_hex)
-
-                            real_size_int = len(payload_hex) // 2
-
-                            self.logger.debug("+++++++++++++++++++++++++++++++++++++++++ getdata tx +++++++++++++++++++++++++++++++++++++++++\n")
-                            self.logger.debug("command: " + command + "\n")
-                            
-                            self.logger.debug("size: " + str(real_size_int) + " bytes\n")
-                            
-                            self.logger.debug("checksum: " + str(checksum) + "\n")
-                            self.logger.debug("payload: " + payload_hex + "\n")
-
-                            self.log_decoded_details(payload_hex)
-                            self.logger.debug("\n")
-                            message = magic_bytes + command_hex + size_protocol + checksum + payload_hex
-                            client.send(bytes.fromhex(message))
-
-                        if self.MODE is Mode.GETDATA_BLOCK:
-                            self.MODE = Mode.IDLE
-                            command = "getdata"
-                            command_hex = str_to_hex(command, 12)
-                            payload_hex = "02" + self.headers.last_block_hash # jeden blok (ostatni) dlatego 02 varint
-                            size = count_payload(payload_hex, 4)
-                            checksum = checksum_f(payload_hex)
-
-                            self.logger.debug("+++++++++++++++++++++++++++++++++++++++++ getdata block +++++++++++++++++++++++++++++++++++++++++\n")
-                            self.logger.debug("command: " + command + "\n")
-                            self.logger.debug("size: " + str(size) + "\n")
-                            self.logger.debug("checksum: " + str(checksum) + "\n")
-                            self.logger.debug("payload: " + payload_hex + "\n")
-
-                            message = magic_bytes + command_hex + size + checksum + payload_hex
-                            client.send(bytes.fromhex(message))
-
-                        if self.MODE is Mode.GETHEADERS:
-                            self.MODE = Mode.IDLE
-                            client.send(bytes.fromhex(getheaders_message))
-                            fields = get_msg_fields()
-
-                            self.logger.debug("+++++++++++++++++++++++++++++++++++++++++ getheaders +++++++++++++++++++++++++++++++++++++++++\n")
-                            self.logger.debug("command: getheaders\n")
-                            self.logger.debug("size: " + str(fields[1]) + "\n")
-                            self.logger.debug("checksum: " + str(fields[2]) + "\n")
-                            self.logger.debug("payload: " + fields[3] + "\n")
-
-                        if self.MODE is Mode.GETBLOCKS:
-                            self.MODE = Mode.IDLE
-                            client.send(bytes.fromhex(getblocks_message))
-                            fields = get_msg_fields()
-
-                            self.logger.debug("+++++++++++++++++++++++++++++++++++++++++ getblocks +++++++++++++++++++++++++++++++++++++++++\n")
-                            self.logger.debug("command: getblocks\n")
-                            self.logger.debug("size: " + str(fields[1]) + "\n")
-                            self.logger.debug("checksum: " + str(fields[2]) + "\n")
-                            self.logger.debug("payload: " + fields[3] + "\n")
-
-                        if command_dec == "headers":
-                            command = "headers"
-
-                            command_hex = str_to_hex(command, 12)
-                            size = count_payload(payload_hex, 4)
-                            checksum = checksum_f(payload_hex)
-                            self.headers.unpack_block_headers(payload_hex)
-
-                            self.logger.debug("======================================= headers =======================================\n")
-                            self.logger.debug("command: " + command + "\n")
-                            self.logger.debug("size: " + str(size) + "\n")
-                            self.logger.debug("checksum: " + str(checksum) + "\n")
-                            self.logger.debug("payload: " + payload_hex + "\n")
-                        break
-
-                    buffer = ''
\ No newline at end of file
+                continue
+
+            command_dec, payload, checksum = frame
+            self.last_received = time.monotonic()
+            guard = self.guard_for(client)
+            if not guard.allow_message():
+                if guard.banned:
+                    self.cut_off(client)
+                continue
+            if self.offloader is not None and command_dec not in CONTROL_COMMANDS:
+                # duze payloady dekoduje pula, petla wraca od razu do gniazda (ping/pong nie czeka na blok);
+                # pozostale wiadomosci ida ta sama kolejka, zeby np. cmpctblock nie wyprzedzil headers
+                self.offloader.submit(command_dec, payload,
+                                      functools.partial(self.handle_queued, client, command_dec, payload, checksum),
+                                      functools.partial(self.handling_failed, guard, client, command_dec))
+            else:
+                try:
+                    self.handle_message(client, command_dec, payload, checksum)
+                except (ValueError, IndexError, struct.error) as e:
+                    self.handling_failed(guard, client, command_dec, e)
+            if guard.banned:
+                self.cut_off(client)
+            self.handle_mode(client)
+
+    def handling_failed(self, guard, client, command_dec, error) -> None:
+        """A message that could not be decoded or handled; malformed payloads count against the peer.
+
+        Called from the delivery thread for queued messages, hence the guard is
+        the one of the connection the message came from.
+        """
+        if not isinstance(error, (ValueError, IndexError, struct.error)):
+            self.logger.error("Handling " + command_dec + " failed: " + repr(error))
+            return
+        self.logger.info("Malformed " + command_dec + " message: " + str(error))
+        guard.misbehaving(MALFORMED_SCORE, "malformed " + command_dec)
+        if guard.banned:
+            self.cut_off(client)
+
+    def handle_queued(self, client, command_dec, payload, checksum, decoded) -> None:
+        """Delivery of a queued message; dropped if its connection was replaced in the meantime.
+
+        Handling it would call writer_for/guard_for with the dead socket and
+        replace the writer and guard of the new pooled connection.
+        """
+        with self.state_lock:
+            if client is not self.reading_client:
+                self.logger.debug("dropping " + command_dec + " from a closed connection\n")
+                return
+            self._handle_message(client, command_dec, payload, checksum, decoded)
+
+    def handle_message(self, client, command_dec, payload, checksum, decoded=None) -> None:
+        """decoded: result of offload.decode_payload when the payload was parsed in a worker."""
+        with self.state_lock:
+            self._handle_message(client, command_dec, payload, checksum, decoded)
+
+    def _handle_message(self, client, command_dec, payload, checksum, decoded) -> None:
+        payload_hex = bytes_to_hex_str(payload)
+
+        self.logger.debug("======================================= any command =============================================\n")
+        self.logger.debug("command: " + command_dec + "\n")
+        self.logger.debug("size: " + str(len(payload)) + "\n")
+        self.logger.debug("checksum: " + bytes_to_hex_str(checksum) + "\n")
+        self.logger.debug("payload: " + payload_hex + "\n")
+
+        if self.features.update(command_dec, payload):
+            self.logger.info("Peer features: " + str(self.features))
+
+        if command_dec == "ping":
+            self.logger.info("Ping command received.")
+            self.send(client, "pong", payload)
+            self.logger.info("Answering with command pong.")
+
+        if command_dec in ("addr", "addrv2"):
+            self.MODE = Mode.IDLE
+            if command_dec == "addr":
+                a_list = self.addr.unpack_addresses(payload_hex)
+            else:
+                a_list = self.addr.unpack_addresses_v2(payload_hex)
+            guard = self.guard_for(client)
+            if len(a_list) > MAX_ADDR_SIZE:
+                guard.misbehaving(TOO_MANY_ITEMS_SCORE, f"{command_dec} with {len(a_list)} addresses")
+                return
+            # nadmiar ponad limit tempa odrzucamy (lista jest od najnowszych)
+            a_list = a_list[:guard.allow_addr(len(a_list))]
+            # zapis na dysk robi watek AddrStore, petla odbioru nie czeka
+            self.addr_store.submit(a_list)
+            self.publish("addr", (addr_record(addr) for addr in a_list))
+
+            #for addr in a_list:
+            #    print(addr)
+
+            printed = set()
+
+            for addr in a_list:
+                if not is_sensible_addr(addr, self.network.port):
+                    continue
+
+                key = (addr.ip, addr.port)
+                if key in printed:
+                    continue
+
+                printed.add(key)
+                print_addr(addr)
+
+        if command_dec == "inv":
+            command = "inv"
+
+            command_hex = str_to_hex(command, 12)
+            size = count_payload(payload_hex, 4)
+            checksum = bytes_to_hex_str(checksum)  # z naglowka wiadomosci, bez ponownego sha256
+
+            if decoded is not None:
+                inv_vector_list = decoded
+                self.inv.track(inv_vector_list)
+            else:
+                inv_vector_list = self.inv.unpack_transactions(payload_hex)
+            guard = self.guard_for(client)
+            if len(inv_vector_list) > MAX_INV_SIZE:
+                guard.misbehaving(TOO_MANY_ITEMS_SCORE, f"inv with {len(inv_vector_list)} items")
+                return
+            blocks = [bytes.fromhex(v.hash)[4:] for v in inv_vector_list if v.name in ("MSG_BLOCK", "MSG_WITNESS_BLOCK")]
+            peer_height = None if self.peer_version is None else self.peer_version.start_height
+            walk_batch = (self.block_walk is not None
+                          and self.block_walk.accepts(blocks, peer_height, self.headers.parent_of))
+            if not walk_batch:
+                # odpowiedz na nasz getblocks nie liczy sie do limitu
+                inv_vector_list = inv_vector_list[:guard.allow_inv(len(inv_vector_list))]
+            self.publish("inv", (inv_record(v) for v in inv_vector_list))
+            if self.latency_monitor is not None and len(blocks) <= MAX_BLOCKS_TO_ANNOUNCE:
+                for block_hash in blocks:
+                    self.latency_monitor.record(self.peer_name(), block_hash, "inv")
+            if walk_batch:
+                self.continue_walk(client, blocks)
+            elif self.follow_tip:
+                self.request_tip_data(client, inv_vector_list)
+
+            self.logger.debug("======================================= inv =============================================\n")
+            self.logger.debug("command: " + command + "\n")
+            self.logger.debug("size: " + str(size) + "\n")
+            self.logger.debug("checksum: " + str(checksum) + "\n")
+            self.logger.debug("payload: " + payload_hex + "\n")
+            # command = "getdata"
+            # command_hex = str_to_hex(command, 12)
+            # inv_vector_list = self.inv.unpack_transactions(payload_hex)
+            # if not inv_vector_list:
+            #     print("Brak transakcji w inv_vector_list")
+            #     continue
+            # while True:
+            #     inv_vector = random.choice(inv_vector_list)
+            #     if inv_vector.name == "MSG_TX":
+            #         payload_hex = "01" + inv_vector.hash
+            #         break
+            # size = count_payload(payload_hex, 4)
+            # checksum = checksum_f(payload_hex)
+            #
+            # self.logger.debug("======================================= getdata =============================================\n")
+            # self.logger.debug("command: " + command + "\n")
+            # self.logger.debug("size: " + str(size) + "\n")
+            # self.logger.debug("checksum: " + str(checksum) + "\n")
+            # self.logger.debug("payload: " + payload_hex + "\n")
+            #
+            # # odpowiedz dowolnym getdata zeby node nie rozlaczal
+            # message = magic_bytes + command_hex + size + checksum + payload_hex
+            # self.logger.debug("spraawdzenie: " + str(bytes.fromhex(message)))
+            # client.send(bytes.fromhex(message))
+
+        if command_dec == "headers":
+            command = "headers"
+
+            command_hex = str_to_hex(command, 12)
+            size = count_payload(payload_hex, 4)
+            checksum = bytes_to_hex_str(checksum)  # z naglowka wiadomosci, bez ponownego sha256
+            if decoded is not None:
+                block_headers, hashes = decoded
+                self.headers.accept(block_headers, hashes)
+            else:
+                block_headers = self.headers.unpack_block_headers(payload_hex)
+            self.publish("header", (header_record(header, block_hash, self.headers.height_of(block_hash))
+                                    for header in map(bytes.fromhex, block_headers)
+                                    for block_hash in (double_sha256(header),)))
+            if self.latency_monitor is not None and len(block_headers) <= MAX_BLOCKS_TO_ANNOUNCE:
+                for header in block_headers:
+                    self.latency_monitor.record(self.peer_name(), double_sha256(bytes.fromhex(header)), "headers")
+            last_hash = double_sha256(bytes.fromhex(block_headers[-1])) if block_headers else None
+            if last_hash is not None and not self.headers.knows(last_hash):
+                # naglowki nie lacza sie z naszymi - dociagamy od naszego tipa; jak w Core co 10 takich kosztuje punkty
+                self.unconnecting_headers += 1
+                if self.unconnecting_headers % 10 == 0:
+                    self.guard_for(client).misbehaving(MALFORMED_SCORE, "unconnecting headers")
+                self.sync_headers(client)
+            elif len(block_headers) == MAX_HEADERS_RESULTS:
+                # pelna paczka - peer ma wiecej
+                self.unconnecting_headers = 0
+                self.sync_headers(client)
+            elif last_hash is not None:
+                self.unconnecting_headers = 0
+                if self.follow_tip and len(block_headers) <= MAX_BLOCKS_TO_ANNOUNCE:
+                    # przy sendheaders nowy blok przychodzi jako headers - prosimy o compact block
+                    self.request_data(client, [(MSG_CMPCT_BLOCK, last_hash)])
+
+            self.logger.debug("======================================= headers =======================================\n")
+            self.logger.debug("command: " + command + "\n")
+            self.logger.debug("size: " + str(size) + "\n")
+            self.logger.debug("checksum: " + str(checksum) + "\n")
+            self.logger.debug("payload: " + payload_hex + "\n")
+
+        if command_dec == "tx":
+            try:
+                tx = decoded if decoded is not None else Transaction(payload)
+                self.in_flight.pop(tx.txid, None)
+                self.in_flight.pop(tx.wtxid, None)
+                self.mempool.add(tx)
+                self.publish("tx", (tx_record(tx),))
+            except (ValueError, IndexError, struct.error):
+                self.logger.debug("malformed tx: " + payload_hex + "\n")
+
+        if command_dec == "block":
+            block = decoded if decoded is not None else Block(payload)
+            if block.is_valid():
+                self.on_block(block)
+            else:
+                # txs nie pasuja do naglowka - nie indeksujemy i nie czyscimy nim mempoola
+                self.logger.info("Block " + block.hash[::-1].hex() + " failed the merkle check, dropped.")
+                self.guard_for(client).misbehaving(MALFORMED_SCORE, "block with a bad merkle root")
+
+        if command_dec == "cmpctblock":
+            compact = CompactBlock(payload)
+            if self.latency_monitor is not None:
+                self.latency_monitor.record(self.peer_name(), compact.hash, "cmpctblock")
+            # bez follow_tip nie skladamy blokow - getblocktxn sciagalby prawie caly blok od kazdego peera
+            if not self.follow_tip or compact.hash in self.partial_blocks or compact.hash in self.recent_blocks:
+                return
+            partial = PartialBlock(compact, self.mempool.snapshot())
+            missing = len(partial.missing())
+            self.logger.info(f"cmpctblock {compact.hash[::-1].hex()}: {compact.tx_count()} txs, {missing} missing")
+            if missing == 0:
+                self.block_reconstructed(client, partial)
+            else:
+                self.partial_blocks[compact.hash] = partial
+                if len(self.partial_blocks) > 16:
+                    self.request_failed(self.partial_blocks.pop(next(iter(self.partial_blocks))).hash)
+                if not self.send(client, "getblocktxn", partial.getblocktxn_payload()):
+                    self.partial_blocks.pop(compact.hash, None)
+                    self.request_failed(compact.hash)
+
+        if command_dec == "blocktxn":
+            partial = self.partial_blocks.pop(payload[:32], None)
+            if partial is not None:
+                if partial.fill(payload):
+                    self.block_reconstructed(client, partial)
+                else:
+                    self.request_failed(partial.hash)
+
+        if command_dec == "notfound":
+            # peer nie ma tego, o co prosilismy - inny peer moze miec
+            count, offset = read_varint(payload)
+            for start in range(offset, min(len(payload), offset + 36 * count), 36):
+                self.request_failed(payload[start + 4:start + 36])
+
+    def continue_walk(self, client, blocks) -> None:
+        # nastepny getblocks idzie od razu, zapis na dysk juz w trakcie oczekiwania na odpowiedz
+        if self.block_walk.add_batch(blocks):
+            self.send(client, "getblocks", self.block_walk.request())
+        self.block_walk.checkpoint()
+        print(f"Block walk: height {self.block_walk.tip_height()}")
+
+    def sync_headers(self, client) -> None:
+        """getheaders from our header tip; continued after every full batch until the peer's tip."""
+        payload = getheaders.build_getheaders(self.headers.locator())
+        self.send(client, "getheaders", payload)
+
+        self.logger.debug("+++++++++++++++++++++++++++++++++++++++++ getheaders +++++++++++++++++++++++++++++++++++++++++\n")
+        self.logger.debug("command: getheaders\n")
+        self.logger.debug("size: " + str(len(payload)) + "\n")
+        self.logger.debug("checksum: " + checksum_bytes(payload).hex() + "\n")
+        self.logger.debug("payload: " + payload.hex() + "\n")
+
+    def request_high_bandwidth(self, client) -> None:
+        """Asks the peer to push new blocks as cmpctblock without announcing them first (BIP152)."""
+        if self.peer_version is not None and supports_cmpct(self.peer_version):
+            self.send(client, "sendcmpct", sendcmpct_payload(True))
+
+    def send_getdata(self, client, vectors) -> bool:
+        """vectors: list of (inv type, hash in internal byte order)."""
+        if not vectors:
+            return False
+        payload = varint_bytes(len(vectors)) + b''.join(struct.pack('<I', t) + h for t, h in vectors)
+        return self.send(client, "getdata", payload)
+
+    def request_data(self, client, vectors) -> None:
+        """getdata for the vectors not requested recently.
+
+        Hashes are marked in seen_inv only once the request is queued, and
+        request_failed() unmarks them, so a failed fetch can be retried from
+        another peer without waiting for the TTL.
+        """
+        vectors = [(t, h) for t, h in vectors if self.seen_inv.get(h) is None]
+        if not self.send_getdata(client, vectors):
+            return
+        for _, inv_hash in vectors:
+            self.seen_inv.put(inv_hash, True)
+            self.in_flight[inv_hash] = None
+        while len(self.in_flight) > MAX_IN_FLIGHT:
+            self.in_flight.pop(next(iter(self.in_flight)))
+
+    def request_failed(self, inv_hash) -> None:
+        self.in_flight.pop(inv_hash, None)
+        self.seen_inv.pop(inv_hash)
+
+    def forget_in_flight(self) -> None:
+        """The connection is gone: unanswered requests may be sent to the next peer."""
+        with self.state_lock:
+            for inv_hash in self.in_flight:
+                self.seen_inv.pop(inv_hash)
+            self.in_flight.clear()
+
+    def request_tip_data(self, client, inv_vector_list) -> None:
+        """Fills the mempool from tx announcements and asks for new blocks as compact blocks."""
+        vectors = []
+        wanted = set()
+        for inv_vector in inv_vector_list:
+            inv_hash = bytes.fromhex(inv_vector.hash)[4:]
+            if inv_hash in wanted:
+                continue
+            wanted.add(inv_hash)
+            if inv_vector.name == "MSG_WTX" and inv_hash not in self.mempool:
+                vectors.append((MSG_WTX, inv_hash))
+            elif inv_vector.name in ("MSG_TX", "MSG_WITNESS_TX") and inv_hash not in self.mempool:
+                vectors.append((MSG_WITNESS_TX, inv_hash))
+            elif inv_vector.name in ("MSG_BLOCK", "MSG_WITNESS_BLOCK"):
+                vectors.append((MSG_CMPCT_BLOCK, inv_hash))
+        self.request_data(client, vectors)
+
+    def block_reconstructed(self, client, partial) -> None:
+        block_hash = partial.hash[::-1].hex()
+        if not partial.is_valid():
+            # kolizja short id - zamiast zgadywac prosimy o caly blok
+            self.logger.info("Compact block " + block_hash + " failed the merkle check, fetching full block.")
+            self.send_getdata(client, [(MSG_WITNESS_BLOCK, partial.hash)])
+            return
+        self.last_block = partial.block_bytes()
+        self.logger.info(f"Block {block_hash} reconstructed: {len(partial.txs)} txs, {len(self.last_block)} bytes")
+        self.on_block(Block(self.last_block))
+
+    def on_block(self, block) -> None:
+        """Common path for full and reconstructed blocks."""
+        self.in_flight.pop(block.hash, None)
+        self.recent_blocks.put(block.hash, True)
+        self.mempool.remove_block(block.txs)
+        height = self.headers.connect(block.header)
+        print(f"Block {block.hash[::-1].hex()} height: {height} txs: {len(block.txs)}")
+        self.publish("block", (block_record(block, height),))
+        if self.tx_index is None:
+            return
+        if height is None:
+            self.logger.info("Block " + block.hash[::-1].hex() + " is not on the active header chain, not indexed.")
+            return
+        self.tx_index.index_block(block, height)
+
+    def attach_tx_index(self, tx_index) -> None:
+        self.tx_index = tx_index
+        self.headers.reorg_listeners.append(tx_index.disconnect_to)
+
+    def handle_mode(self, client) -> None:
+        if self.MODE is Mode.WALK_BLOCKS:
+            self.MODE = Mode.IDLE
+            if self.block_walk is None or self.block_walk.complete:
+                self.block_walk = BlockHashWalk(self.network.path("block_hashes.bin"), self.network.genesis_hash)
+            print(f"Walking block hashes with getblocks from height {self.block_walk.tip_height()}")
+            self.send(client, "getblocks", self.block_walk.request())
+
+        if self.block_walk is not None and self.block_walk.stalled():
+            self.logger.info("Block walk: getblocks unanswered, asking again")
+            self.send(client, "getblocks", self.block_walk.request())
+
+        if self.MODE is Mode.FOLLOW_TIP:
+            self.MODE = Mode.IDLE
+            self.follow_tip = True
+            self.request_high_bandwidth(client)
+            # wysokosci nowych blokow (do indeksu) znamy dopiero z naglowkami do tipa
+            self.sync_headers(client)
+            print("Following the tip: collecting mempool and requesting compact blocks.")
+
+        if self.MODE is Mode.GETADDR:
+            self.MODE = Mode.IDLE
+            # getaddr nie ma payloadu
+            self.send(client, "getaddr")
+            self.logger.debug("+++++++++++++++++++++++++++++++++++++++++ getaddr +++++++++++++++++++++++++++++++++++++++++\n")
+            self.logger.info("getaddr: asking for information about known active peers.")
+
+        if self.MODE is Mode.GETDATA_TX:
+            self.MODE = Mode.IDLE
+            if self.inv.transaction is None:
+                print("No transaction announced yet.")
+                return
+            command = "getdata"
+            command_hex = str_to_hex(command, 12)
+
+            payload_hex = "01" + self.inv.transaction.hash
+
+            size_protocol = count_payload(payload_hex, 4)
+            checksum = checksum_f(payload_hex)
+
+            real_size_int = len(payload_hex) // 2
+
+            self.logger.debug("+++++++++++++++++++++++++++++++++++++++++ getdata tx +++++++++++++++++++++++++++++++++++++++++\n")
+            self.logger.debug("command: " + command + "\n")
+
+            self.logger.debug("size: " + str(real_size_int) + " bytes\n")
+
+            self.logger.debug("checksum: " + str(checksum) + "\n")
+            self.logger.debug("payload: " + payload_hex + "\n")
+
+            self.log_decoded_details(payload_hex)
+            self.logger.debug("\n")
+            self.send(client, command, bytes.fromhex(payload_hex))
+
+        if self.MODE is Mode.GETDATA_BLOCK:
+            self.MODE = Mode.IDLE
+            if self.headers.last_block_hash is None:
+                print("No block headers received yet.")
+                return
+            # getdata z jednym wektorem: typ MSG_WITNESS_BLOCK + hash ostatniego naglowka
+            block_hash = double_sha256(bytes.fromhex(self.headers.last_block_hash))
+
+            self.logger.debug("+++++++++++++++++++++++++++++++++++++++++ getdata block +++++++++++++++++++++++++++++++++++++++++\n")
+            self.logger.debug("command: getdata\n")
+            self.logger.debug("block: " + block_hash[::-1].hex() + "\n")
+
+            self.send_getdata(client, [(MSG_WITNESS_BLOCK, block_hash)])
+
+        if self.MODE is Mode.GETHEADERS:
+            self.MODE = Mode.IDLE
+            self.sync_headers(client)
+
+        if self.MODE is Mode.GETBLOCKS:
+            self.MODE = Mode.IDLE
+            payload = getblocks.build_getblocks([self.network.genesis])
+            self.send(client, "getblocks", payload)
+
+            self.logger.debug("+++++++++++++++++++++++++++++++++++++++++ getblocks +++++++++++++++++++++++++++++++++++++++++\n")
+            self.logger.debug("command: getblocks\n")
+            self.logger.debug("size: " + str(len(payload)) + "\n")
+            self.logger.debug("checksum: " + checksum_bytes(payload).hex() + "\n")
+            self.logger.debug("payload: " + payload.hex() + "\n")
@@ -0,0 +1,231 @@
+import logging
+import os
+import random
+import socket
+import threading
+import time
+
+from commands.addr import Addr
+from communication import Communication
+from network import MAINNET
+from outbound import OutboundWriter, TokenBucket
+from utils import read_frame
+
+
+class PeerConnection:
+    def __init__(self, node, client):
+        self.node = node
+        self.client = client
+        self.rtt: float | None = None  # ostatni zmierzony ping-pong w sekundach
+        self.peer_version = None
+        self.features = None
+        self.writer: OutboundWriter | None = None
+        self.last_ping = time.monotonic()
+
+    def key(self):
+        return self.node.host_v4, self.node.port
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close(flush_timeout=0)
+        try:
+            self.client.close()
+        except OSError:
+            pass
+
+    def __str__(self):
+        rtt = "?" if self.rtt is None else f"{self.rtt * 1000:.0f} ms"
+        return f"{self.node} rtt={rtt}"
+
+
+class ConnectionPool:
+    """Keeps `target` handshaked outbound connections ready to be borrowed.
+
+    A background thread opens connections (peers are drawn from the AddrStore,
+    falling back to addresses.json), pings idle ones every ping_interval seconds
+    to check liveness and measure RTT, and evicts peers that do not answer within
+    max_rtt. Callers get an already handshaked socket from acquire() and give it
+    back with release(), marking it broken if the peer went away.
+
+    Every connection sends through its own OutboundWriter; send_rate limits a
+    single peer and global_send_rate all pooled connections together (bytes/s).
+    With `connect` (a list of Nodes, like -connect in Bitcoin Core) only those
+    peers are used, so the pool can reach a local regtest node that the address
+    filters would never draw.
+    """
+
+    def __init__(self, target=4, addr_store=None, ping_interval=60.0, max_rtt=5.0,
+                 connect_timeout=3.0, read_timeout=10.0, send_rate=None, global_send_rate=None, network=None,
+                 connect=None):
+        self.logger = logging.getLogger('bitcoin')
+        self.network = network or MAINNET
+        self.connect = connect or []
+        self.target = target
+        self.addr_store = addr_store
+        self.addr = Addr()
+        self.ping_interval = ping_interval
+        self.max_rtt = max_rtt
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.send_rate = send_rate
+        self.send_bucket = TokenBucket(global_send_rate) if global_send_rate else None
+        self.idle: list[PeerConnection] = []
+        self.borrowed: set[PeerConnection] = set()
+        self.cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if self.addr_store is not None:
+            self.addr_store.start()
+        self._thread = threading.Thread(target=self._maintain, name="connection-pool", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        with self.cond:
+            self.cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self.cond:
+            for conn in self.idle + list(self.borrowed):
+                conn.close()
+            self.idle.clear()
+            self.borrowed.clear()
+
+    def size(self):
+        with self.cond:
+            return len(self.idle) + len(self.borrowed)
+
+    def acquire(self, timeout=None) -> PeerConnection | None:
+        """Returns the idle connection with the lowest RTT, waiting up to timeout seconds for one."""
+        self.start()
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.idle or self._stop.is_set(), timeout) or self._stop.is_set():
+                return None
+            conn = min(self.idle, key=lambda c: float('inf') if c.rtt is None else c.rtt)
+            self.idle.remove(conn)
+            self.borrowed.add(conn)
+            self.cond.notify_all()
+            return conn
+
+    def release(self, conn, broken=False):
+        with self.cond:
+            self.borrowed.discard(conn)
+            if broken or self._stop.is_set():
+                self.logger.info(f"Pool: dropping {conn}")
+                conn.close()
+            else:
+                self.idle.append(conn)
+            self.cond.notify_all()
+
+    def evict(self, conn):
+        self.release(conn, broken=True)
+
+    def stats(self):
+        with self.cond:
+            return [str(conn) for conn in self.idle] + [str(conn) + " (borrowed)" for conn in self.borrowed]
+
+    def ping(self, conn) -> bool:
+        """Sends ping and waits up to max_rtt for the matching pong; answers the peer's pings meanwhile."""
+        nonce = os.urandom(8)
+        started = time.monotonic()
+        try:
+            conn.writer.send("ping", nonce)
+            while True:
+                remaining = started + self.max_rtt - time.monotonic()
+                if remaining <= 0:
+                    return False
+                conn.client.settimeout(remaining)
+                frame = read_frame(conn.client, self.network.magic)
+                if frame is None:
+                    return False
+                command_dec, payload, _ = frame
+                if command_dec == "ping":
+                    conn.writer.send("pong", payload)
+                elif command_dec == "pong" and payload == nonce:
+                    conn.rtt = time.monotonic() - started
+                    conn.last_ping = time.monotonic()
+                    return True
+        except (OSError, ValueError):
+            return False  # ValueError: OversizedMessage, strumien nie do odratowania
+        finally:
+            try:
+                conn.client.settimeout(self.read_timeout)
+            except OSError:
+                pass
+
+    def _maintain(self):
+        while not self._stop.is_set():
+            self._fill()
+            self._ping_idle()
+            with self.cond:
+                self.cond.wait(1.0)
+
+    def _fill(self):
+        while not self._stop.is_set() and self.size() < self.target:
+            conn = self._open()
+            if conn is None:
+                return
+            with self.cond:
+                self.idle.append(conn)
+                self.cond.notify_all()
+            self.logger.info(f"Pool: connected to {conn.node} ({self.size()}/{self.target})")
+
+    def _ping_idle(self):
+        now = time.monotonic()
+        with self.cond:
+            due = [conn for conn in self.idle if now - conn.last_ping >= self.ping_interval]
+            for conn in due:
+                self.idle.remove(conn)
+        for conn in due:
+            alive = self.ping(conn)
+            with self.cond:
+                if alive:
+                    self.idle.append(conn)
+                    self.cond.notify_all()
+                    continue
+            self.logger.info(f"Pool: evicting {conn}, no pong within {self.max_rtt} s")
+            conn.close()
+
+    def _draw(self):
+        if self.connect:
+            return random.choice(self.connect)
+        node = self.addr_store.draw() if self.addr_store is not None else None
+        return node if node is not None else self.addr.draw(self.network.path("addresses.json"), self.network.port)
+
+    def _open(self, max_tries=20) -> PeerConnection | None:
+        with self.cond:
+            in_use = {conn.key() for conn in self.idle} | {conn.key() for conn in self.borrowed}
+        for _ in range(max_tries):
+            node = self._draw()
+            if node is None or node.host_v4 is None or (node.host_v4, node.port) in in_use:
+                continue
+            if self.addr_store is not None and self.addr_store.is_banned(node.host_v4):
+                continue
+            try:
+                client = socket.create_connection((node.host_v4, node.port), timeout=self.connect_timeout)
+            except OSError as e:
+                self.logger.debug(f"Pool: failed to connect to {node}: {e}\n")
+                continue
+            client.settimeout(self.read_timeout)
+            writer = OutboundWriter(client, rate=self.send_rate, global_bucket=self.send_bucket, magic=self.network.magic)
+            try:
+                comm = Communication(node, network=self.network)
+                comm.writer = writer
+                if self.addr_store is not None:
+                    comm.addr_store = self.addr_store  # ban za zachowanie w handshake trafia do wspolnego store
+                if comm.handshake(client):
+                    conn = PeerConnection(node, client)
+                    conn.peer_version = comm.peer_version
+                    conn.features = comm.features
+                    conn.writer = writer
+                    return conn
+            except OSError as e:
+                self.logger.debug(f"Pool: handshake with {node} failed: {e}\n")
+            writer.close(flush_timeout=0)
+            client.close()
+        return None
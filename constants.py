@@ -17,4 +17,40 @@ local: dict[str, str] = {
     "PORT":"8333",
 }
 
-BYTE_IN_CHARS = 2
\ No newline at end of file
+BYTE_IN_CHARS = 2
+MAGIC_BYTES = b'\xf9\xbe\xb4\xd9'
+PROTOCOL_VERSION = 70016
+GENESIS_HASH = "000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f"
+# najlatwiejszy dopuszczalny target (powLimit w Bitcoin Core)
+POW_LIMIT = (1 << 224) - 1
+
+# limity rozmiaru payloadu sprawdzane w read_frame, zanim cokolwiek odczytamy
+MAX_PAYLOAD_SIZE = 32 * 1024 * 1024
+MAX_BLOCK_SIZE = 4_000_000
+MAX_INV_SIZE = 50_000
+MAX_ADDR_SIZE = 1000
+MAX_HEADERS_RESULTS = 2000
+MAX_PAYLOAD_SIZES = {
+    "block": MAX_BLOCK_SIZE,
+    "blocktxn": MAX_BLOCK_SIZE,
+    "cmpctblock": MAX_BLOCK_SIZE,
+    "tx": MAX_BLOCK_SIZE,
+    "inv": 9 + MAX_INV_SIZE * 36,
+    "getdata": 9 + MAX_INV_SIZE * 36,
+    "notfound": 9 + MAX_INV_SIZE * 36,
+    "headers": 9 + MAX_HEADERS_RESULTS * 81,
+    "addr": 9 + MAX_ADDR_SIZE * 30,
+    "addrv2": 9 + MAX_ADDR_SIZE * 550,
+    "getheaders": 4 + 9 + 101 * 32 + 32,
+    "getblocks": 4 + 9 + 101 * 32 + 32,
+    "version": 1024,
+    "verack": 0,
+    "ping": 8,
+    "pong": 8,
+    "getaddr": 0,
+    "sendheaders": 0,
+    "wtxidrelay": 0,
+    "sendaddrv2": 0,
+    "sendcmpct": 9,
+    "feefilter": 8,
+}
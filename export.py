@@ -0,0 +1,277 @@
+import json
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+from collections import deque
+
+from commands.addr_utils import normalize_ip, services_to_int
+from utils import make_parent_dir
+
+# kolumny (i typy numpy) rekordow kazdego rodzaju zdarzenia; hashe jak w eksploratorach (odwrocone)
+FIELDS = {
+    "addr": (("time", "f8"), ("peer", "U"), ("ip", "U"), ("port", "i8"), ("services", "u8"), ("timestamp", "i8")),
+    "inv": (("time", "f8"), ("peer", "U"), ("type", "U"), ("hash", "U")),
+    "header": (("time", "f8"), ("peer", "U"), ("hash", "U"), ("prev_hash", "U"), ("height", "i8"),
+               ("version", "i8"), ("timestamp", "i8"), ("bits", "i8"), ("nonce", "i8")),
+    "tx": (("time", "f8"), ("peer", "U"), ("txid", "U"), ("wtxid", "U"), ("size", "i8"),
+           ("inputs", "i8"), ("outputs", "i8"), ("value", "i8")),
+    "block": (("time", "f8"), ("peer", "U"), ("hash", "U"), ("prev_hash", "U"), ("height", "i8"),
+              ("timestamp", "i8"), ("txs", "i8"), ("size", "i8")),
+}
+EVENT_KINDS = tuple(FIELDS)
+
+
+def addr_record(address):
+    return {"ip": normalize_ip(address.ip), "port": address.port, "services": services_to_int(address.services),
+            "timestamp": int(address.timestamp.timestamp())}
+
+
+def inv_record(inv_vector):
+    return {"type": inv_vector.name, "hash": bytes.fromhex(inv_vector.hash)[4:][::-1].hex()}
+
+
+def header_record(header: bytes, block_hash: bytes, height):
+    version, = struct.unpack_from('<i', header)
+    timestamp, bits, nonce = struct.unpack_from('<III', header, 68)
+    return {"hash": block_hash[::-1].hex(), "prev_hash": header[4:36][::-1].hex(), "height": height,
+            "version": version, "timestamp": timestamp, "bits": bits, "nonce": nonce}
+
+
+def tx_record(tx):
+    return {"txid": tx.txid[::-1].hex(), "wtxid": tx.wtxid[::-1].hex(), "size": tx.size,
+            "inputs": len(tx.inputs), "outputs": len(tx.outputs), "value": sum(value for value, _ in tx.outputs)}
+
+
+def block_record(block, height):
+    return {"hash": block.hash[::-1].hex(), "prev_hash": block.prev_hash[::-1].hex(), "height": height,
+            "timestamp": struct.unpack_from('<I', block.header, 68)[0], "txs": len(block.txs), "size": block.size}
+
+
+class EventBus:
+    """Delivers decoded addr, inv, header, tx and block records to the subscribed sinks.
+
+    A sink is any object with add(kind, record) and close(). Publishers ask
+    wants(kind) first, so nothing is built for kinds nobody listens to. Sinks
+    also having flush_if_due() are polled every tick seconds by a timer thread,
+    so buffered records reach the disk even when no new ones arrive.
+    """
+
+    def __init__(self, tick=1.0):
+        self.logger = logging.getLogger('bitcoin')
+        self.subscribers: dict[str, list] = {}
+        self.sinks = []
+        self.tick = tick
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def subscribe(self, sink, kinds=EVENT_KINDS):
+        for kind in kinds:
+            self.subscribers.setdefault(kind, []).append(sink)
+        if sink not in self.sinks:
+            self.sinks.append(sink)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, name="export-flush", daemon=True)
+            self._thread.start()
+
+    def wants(self, kind) -> bool:
+        return bool(self.subscribers.get(kind))
+
+    def publish(self, kind, record) -> None:
+        for sink in self.subscribers.get(kind, ()):
+            try:
+                sink.add(kind, record)
+            except (OSError, ValueError, TypeError) as e:
+                self.logger.info(f"Export of {kind} failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for sink in self.sinks:
+            sink.close()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.tick):
+            for sink in list(self.sinks):
+                flush_if_due = getattr(sink, "flush_if_due", None)
+                if flush_if_due is None:
+                    continue
+                try:
+                    flush_if_due()
+                except (OSError, ValueError, TypeError) as e:
+                    self.logger.info(f"Export flush failed: {e}")
+
+
+class NdjsonSink:
+    """One JSON object per line (with a "kind" field), buffered and rotated like the latency log.
+
+    Lines are written every buffer_records records or flush_interval seconds;
+    the file is rotated at max_file_bytes, keeping `keep` old files.
+    """
+
+    def __init__(self, path="events.ndjson", buffer_records=1000, flush_interval=5.0,
+                 max_file_bytes=64 * 1024 * 1024, keep=5):
+        self.path = path
+        self.buffer_records = buffer_records
+        self.flush_interval = flush_interval
+        self.max_file_bytes = max_file_bytes
+        self.keep = keep
+        self.lines: list[str] = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self._file = None
+
+    def add(self, kind, record):
+        line = json.dumps({"kind": kind, **record})
+        with self.lock:
+            self.lines.append(line)
+            if len(self.lines) >= self.buffer_records or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def flush_if_due(self):
+        with self.lock:
+            if self.lines and time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _flush(self):
+        self.last_flush = time.monotonic()
+        if not self.lines:
+            return
+        if self._file is None:
+            make_parent_dir(self.path)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write("\n".join(self.lines) + "\n")
+        self._file.flush()
+        self.lines = []
+        if self._file.tell() >= self.max_file_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.keep - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+class ColumnarSink:
+    """Columnar batches per event kind: Parquet if pyarrow is installed, otherwise .npy per column.
+
+    Records are collected into columns and written every batch_records records
+    (or flush_interval seconds) as directory/<kind>-<n>.parquet, or as a
+    directory/<kind>-<n>/ with one <column>.npy per field (unknown heights are
+    stored as -1 there). Each batch is written under a temporary name and
+    renamed, so readers never see half a file; with max_files set only the
+    newest batches of each kind are kept.
+    """
+
+    def __init__(self, directory="export", batch_records=50_000, flush_interval=300.0, max_files=None,
+                 columnar_format=None):
+        self.logger = logging.getLogger('bitcoin')
+        self.directory = directory
+        self.batch_records = batch_records
+        self.flush_interval = flush_interval
+        self.max_files = max_files
+        self.format = columnar_format or self._available_format()
+        self.columns: dict[str, dict[str, list]] = {}
+        self.counts: dict[str, int] = {}
+        self.written: dict[str, deque] = {}
+        self.sequence = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _available_format():
+        try:
+            import pyarrow.parquet  # noqa: F401
+            return "parquet"
+        except ImportError:
+            pass
+        try:
+            import numpy  # noqa: F401
+            return "npy"
+        except ImportError:
+            raise ImportError("columnar export needs pyarrow or numpy, use NdjsonSink without them")
+
+    def add(self, kind, record):
+        with self.lock:
+            columns = self.columns.get(kind)
+            if columns is None:
+                columns = self.columns[kind] = {name: [] for name, _ in FIELDS[kind]}
+                self.counts[kind] = 0
+            for name, values in columns.items():
+                values.append(record.get(name))
+            self.counts[kind] += 1
+            if self.counts[kind] >= self.batch_records:
+                self._write(kind)
+            elif time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def flush_if_due(self):
+        with self.lock:
+            if self.counts and time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def close(self):
+        self.flush()
+
+    def _flush(self):
+        self.last_flush = time.monotonic()
+        for kind in list(self.columns):
+            self._write(kind)
+
+    def _write(self, kind):
+        columns = self.columns.pop(kind, None)
+        count = self.counts.pop(kind, 0)
+        if not count:
+            return
+        self.sequence += 1
+        name = os.path.join(self.directory, f"{kind}-{int(time.time())}-{self.sequence:06d}")
+        if self.format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            path = name + ".parquet"
+            pq.write_table(pa.table(columns), path + ".tmp", compression="zstd")
+        else:
+            import numpy as np
+            path = name
+            os.makedirs(path + ".tmp")
+            for field, dtype in FIELDS[kind]:
+                values = columns[field]
+                if dtype != "U":
+                    values = [-1 if v is None else v for v in values]
+                np.save(os.path.join(path + ".tmp", field + ".npy"), np.asarray(values, dtype=dtype))
+        os.replace(path + ".tmp", path)
+        self.logger.debug(f"export: {count} {kind} records -> {path}\n")
+        self._rotate(kind, path)
+
+    def _rotate(self, kind, path):
+        written = self.written.setdefault(kind, deque())
+        written.append(path)
+        while self.max_files is not None and len(written) > self.max_files:
+            old = written.popleft()
+            if os.path.isdir(old):
+                shutil.rmtree(old)
+            else:
+                os.remove(old)
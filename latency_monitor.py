@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import socket
+import statistics
+import threading
+import time
+from collections import OrderedDict
+
+from communication import Communication
+from utils import make_parent_dir
+
+
+class LatencyMonitor:
+    """First-seen time of every block per peer, from inv, headers and cmpctblock announcements.
+
+    Times come from time.monotonic_ns(); a peer's delay for a block is measured
+    from the first peer that announced it. Every announcement is appended as a
+    JSON line to a rolling time-series file (rotated at max_file_bytes, keeping
+    `keep` old files).
+    """
+
+    def __init__(self, path="block_latency.ndjson", max_blocks=1000, max_file_bytes=16 * 1024 * 1024, keep=3):
+        self.logger = logging.getLogger('bitcoin')
+        self.path = path
+        self.max_blocks = max_blocks
+        self.max_file_bytes = max_file_bytes
+        self.keep = keep
+        self.first_seen: OrderedDict[bytes, dict[str, int]] = OrderedDict()
+        self.lock = threading.Lock()
+        self._file = None
+
+    def record(self, peer: str, block_hash: bytes, source: str) -> None:
+        now = time.monotonic_ns()
+        with self.lock:
+            peers = self.first_seen.get(block_hash)
+            if peers is None:
+                peers = self.first_seen[block_hash] = {}
+                if len(self.first_seen) > self.max_blocks:
+                    self.first_seen.popitem(last=False)
+            if peer in peers:
+                return
+            first = min(peers.values(), default=now)
+            peers[peer] = now
+            self._write({
+                "time": time.time(),
+                "block": block_hash[::-1].hex(),
+                "peer": peer,
+                "source": source,
+                "delay_ms": (now - first) / 1e6,
+            })
+
+    def _write(self, record):
+        if self._file is None:
+            make_parent_dir(self.path)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        if self._file.tell() >= self.max_file_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.keep - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def delays(self) -> dict[str, list[float]]:
+        """Delay (ms) behind the first announcer, per peer, over all tracked blocks."""
+        result: dict[str, list[float]] = {}
+        with self.lock:
+            for peers in self.first_seen.values():
+                first = min(peers.values())
+                for peer, seen in peers.items():
+                    result.setdefault(peer, []).append((seen - first) / 1e6)
+        return result
+
+    def distribution(self) -> dict[str, float]:
+        """Propagation delay percentiles (ms) over all announcements that were not first."""
+        values = sorted(d for per_peer in self.delays().values() for d in per_peer if d > 0)
+        if not values:
+            return {"count": 0}
+        if len(values) == 1:
+            p50 = p90 = p99 = values[0]
+        else:
+            cuts = statistics.quantiles(values, n=100, method='inclusive')
+            p50, p90, p99 = cuts[49], cuts[89], cuts[98]
+        return {"count": len(values), "p50": p50, "p90": p90, "p99": p99, "max": values[-1]}
+
+    def ranking(self, min_blocks=1) -> list[tuple[str, float, int]]:
+        """(peer, median delay ms, blocks announced), fastest first."""
+        ranked = [(peer, statistics.median(d), len(d)) for peer, d in self.delays().items() if len(d) >= min_blocks]
+        return sorted(ranked, key=lambda r: r[1])
+
+
+class BlockMonitor:
+    """Runs the reading loop on `peers` pooled connections and records block announcements.
+
+    Every rebalance_interval seconds the slowest announcer (by median delay, once
+    it has announced min_blocks blocks) is disconnected; its loop then borrows a
+    replacement from the pool, so over time we stay connected to the fastest peers.
+    A peer that sent nothing for idle_timeout seconds (Bitcoin Core pings every
+    2 minutes) is disconnected the same way, so a silent peer cannot keep its slot.
+    """
+
+    def __init__(self, pool, monitor: LatencyMonitor, addr_store=None, peers=8, rebalance_interval=1800.0, min_blocks=3,
+                 idle_timeout=1200.0, check_interval=60.0):
+        self.logger = logging.getLogger('bitcoin')
+        self.pool = pool
+        self.monitor = monitor
+        self.addr_store = addr_store
+        self.peers = peers
+        self.rebalance_interval = rebalance_interval
+        self.min_blocks = min_blocks
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.communications: list[Communication] = []
+        self._stop = threading.Event()
+
+    def start(self):
+        for _ in range(self.peers):
+            comm = Communication(None, network=self.pool.network)
+            if self.addr_store is not None:
+                comm.addr_store = self.addr_store
+            comm.latency_monitor = self.monitor
+            client = comm.borrow(self.pool)
+            if client is None:
+                break
+            self.communications.append(comm)
+            threading.Thread(target=comm.read_in_loop, args=(client,), daemon=True).start()
+        threading.Thread(target=self._rebalance_loop, name="block-monitor", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        for comm in self.communications:
+            comm.exit()
+            if comm.connection is not None:
+                self.pool.release(comm.connection, broken=True)
+        self.monitor.close()
+
+    def rebalance(self):
+        connected = {comm.peer_name() for comm in self.communications}
+        ranking = [r for r in self.monitor.ranking(self.min_blocks) if r[0] in connected]
+        if len(ranking) < 2:
+            return
+        slowest = ranking[-1][0]
+        for comm in self.communications:
+            if comm.peer_name() == slowest and comm.connection is not None:
+                self.logger.info(f"Monitor: dropping slowest announcer {slowest} ({ranking[-1][1]:.0f} ms median)")
+                self._drop(comm)
+                return
+
+    def drop_idle(self):
+        """Disconnects peers silent for idle_timeout seconds; their loops borrow replacements."""
+        now = time.monotonic()
+        for comm in self.communications:
+            if comm.connection is not None and now - comm.last_received >= self.idle_timeout:
+                self.logger.info(f"Monitor: dropping {comm.peer_name()}, nothing received for {now - comm.last_received:.0f} s")
+                comm.last_received = now  # nie zrywamy drugi raz, zanim petla wezmie nowe polaczenie
+                self._drop(comm)
+
+    def _drop(self, comm):
+        try:
+            comm.connection.client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _rebalance_loop(self):
+        last_rebalance = time.monotonic()
+        while not self._stop.wait(self.check_interval):
+            self.drop_idle()
+            if time.monotonic() - last_rebalance >= self.rebalance_interval:
+                last_rebalance = time.monotonic()
+                self.rebalance()
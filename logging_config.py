@@ -1,24 +1,35 @@
 import logging
 import sys
 
-logger = logging.getLogger('bitcoin')
-logger.setLevel(logging.DEBUG)
 
-# Handler do pliku
-file_handler = logging.FileHandler('bitcoin.log',
-    mode='w',
-    encoding='utf-8'
-)
-file_handler.setLevel(logging.DEBUG)
+def setup_logging(log_file='bitcoin.log', console_level=logging.INFO):
+    """Attaches the file and console handlers to the 'bitcoin' logger.
 
-# Handler do konsoli
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.INFO)  # Tylko ważne komunikaty
+    Called explicitly from the entry point, so importing a module never truncates
+    the log file. Calling it again is a no-op.
+    """
+    logger = logging.getLogger('bitcoin')
+    if getattr(logger, '_configured', False):
+        return logger
+    logger.setLevel(logging.DEBUG)
 
-# Format
-formatter = logging.Formatter('%(asctime)s - %(message)s', datefmt='%H:%M:%S')
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
+    # Handler do pliku
+    file_handler = logging.FileHandler(log_file,
+        mode='w',
+        encoding='utf-8'
+    )
+    file_handler.setLevel(logging.DEBUG)
 
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
\ No newline at end of file
+    # Handler do konsoli
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(console_level)  # Tylko ważne komunikaty
+
+    # Format
+    formatter = logging.Formatter('%(asctime)s - %(message)s', datefmt='%H:%M:%S')
+    file_handler.setFormatter(formatter)
+    console_handler.setFormatter(formatter)
+
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
+    logger._configured = True
+    return logger
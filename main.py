@@ -1,11 +1,20 @@
+import argparse
 import socket
 import threading
 
 import constants
+from cache import cache_stats
 from commands.addr import Addr
 from communication import Communication
+from connection_pool import ConnectionPool
+from export import ColumnarSink, EventBus, NdjsonSink
+from latency_monitor import BlockMonitor, LatencyMonitor
+from logging_config import setup_logging
 from mode import Mode
+from network import MAINNET, NETWORKS
 from node import Node
+from offload import PayloadOffloader
+from tx_index import TxIndex
 
 def print_options():
     print(f"0. exit")
@@ -14,6 +23,10 @@ def print_options():
     print(f"3. do the manual handshake")
     print(f"4. read in loop")
     print(f"5. enter different modes for reading loop")
+    print(f"6. borrow a handshaked connection from the pool")
+    print(f"7. monitor block propagation across pooled peers")
+    print(f"8. transaction index")
+    print(f"9. export decoded messages")
 
 def print_manual_hanshake_options():
     print(f"1. send version")
@@ -31,12 +44,29 @@ def print_mode_options():
     print(f"5. set GETHEADERS mode")
     print(f"6. set GETBLOCKS mode")
     print(f"7. set EXIT mode")
-    print(f"8. back")
+    print(f"8. follow the tip (mempool + compact blocks)")
+    print(f"9. walk all block hashes (getblocks, resumable)")
+    print(f"10. back")
 
-def handle_menu():
+def parse_node(address, network):
+    """HOST[:PORT] of a peer to connect to instead of drawing one, e.g. a local regtest node."""
+    host, _, port = address.partition(':')
+    host_v4 = socket.gethostbyname(host)
+    return Node(host_v4=host_v4, host_v6="::ffff:" + host_v4, port=int(port) if port else network.port)
+
+def handle_menu(network=MAINNET, connect=None):
     is_cached = True
     a = Addr()
-    c = Communication(Node.from_dict(constants.node))
+    node = Node.from_dict(constants.node)
+    # --connect: ten peer zamiast losowania, takze dla puli i monitora
+    connect_nodes = []
+    if connect is not None:
+        node = parse_node(connect, network)
+        connect_nodes.append(node)
+        is_cached = False
+    c = Communication(node, network=network)
+    c.offloader = PayloadOffloader()
+    pool: ConnectionPool | None = None
     client: socket.socket | None = None
     while True:
         print_options()
@@ -45,6 +75,11 @@ def handle_menu():
             case '0':
                 if client is not None:
                     client.close()
+                if pool is not None:
+                    pool.close()
+                c.close()
+                for stats in cache_stats():
+                    print(f"cache {stats['name']}: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%})")
                 print("closing...")
                 break
             case '1':
@@ -56,10 +91,7 @@ def handle_menu():
                 if client is None:
                     print("socket is closed ")
                     continue
-                c.send_version(client)
-                c.read_version(client)
-                c.read_verack(client)
-                c.send_verack(client)
+                c.handshake(client)
             case '3':
                 if client is None:
                     print("socket is closed")
@@ -76,6 +108,86 @@ def handle_menu():
                     print("socket is closed ")
                     continue
                 mode_options(c)
+            case '6':
+                if pool is None:
+                    pool = ConnectionPool(target=len(connect_nodes) or 4, addr_store=c.addr_store, network=network,
+                                          connect=connect_nodes)
+                client = c.borrow(pool)
+                if client is None:
+                    print("no connection available in the pool")
+            case '7':
+                if pool is None:
+                    pool = ConnectionPool(target=len(connect_nodes) or 10, addr_store=c.addr_store, network=network,
+                                          connect=connect_nodes)
+                monitor_blocks(pool, c, peers=len(connect_nodes) or 8)
+            case '8':
+                tx_index_options(c)
+            case '9':
+                export_options(c)
+
+def monitor_blocks(pool, c, peers=8):
+    latency = LatencyMonitor(pool.network.path("block_latency.ndjson"))
+    block_monitor = BlockMonitor(pool, latency, addr_store=c.addr_store, peers=peers)
+    block_monitor.start()
+    print("monitoring block announcements, press Enter to stop")
+    input()
+    block_monitor.stop()
+    print(f"propagation delay (ms): {latency.distribution()}")
+    for peer, median, blocks in latency.ranking():
+        print(f"{peer}: median {median:.0f} ms over {blocks} blocks")
+
+def print_tx_index_options():
+    print(f"1. index fetched blocks")
+    print(f"2. find block of txid")
+    print(f"3. unspent outputs of script (hex)")
+    print(f"4. back")
+
+def tx_index_options(c):
+    print_tx_index_options()
+    choice = input()
+    match choice:
+        case '1':
+            if c.tx_index is None:
+                c.attach_tx_index(TxIndex(c.network.path("tx_index.sqlite")))
+            print("fetched blocks will be indexed")
+        case '2':
+            if c.tx_index is None:
+                print("index is not enabled")
+                return
+            location = c.tx_index.find_tx(bytes.fromhex(input("txid: "))[::-1])
+            print("not found" if location is None else f"height: {location[0]} offset: {location[1]}")
+        case '3':
+            if c.tx_index is None:
+                print("index is not enabled")
+                return
+            for txid, vout, value, height in c.tx_index.outpoints(bytes.fromhex(input("script: "))):
+                print(f"{txid[::-1].hex()}:{vout} value: {value} height: {height}")
+        case '4':
+            return
+
+def print_export_options():
+    print(f"1. line-delimited JSON (events.ndjson)")
+    print(f"2. columnar batches (export/, Parquet or .npy)")
+    print(f"3. back")
+
+def export_options(c):
+    print_export_options()
+    choice = input()
+    match choice:
+        case '1':
+            sink = NdjsonSink(c.network.path("events.ndjson"))
+        case '2':
+            try:
+                sink = ColumnarSink(c.network.path("export"))
+            except ImportError as e:
+                print(e)
+                return
+        case _:
+            return
+    if c.events is None:
+        c.events = EventBus()
+    c.events.subscribe(sink)
+    print("decoded addr, inv, header, tx and block messages will be exported")
 
 def mode_options(c):
     print_mode_options()
@@ -96,6 +208,10 @@ def mode_options(c):
         case '7':
             c.set_mode(Mode.EXIT)
         case '8':
+            c.set_mode(Mode.FOLLOW_TIP)
+        case '9':
+            c.set_mode(Mode.WALK_BLOCKS)
+        case '10':
             return
 
 def manual_handshake(client, c):
@@ -121,4 +237,9 @@ def manual_handshake(client, c):
             break
 
 if __name__ == '__main__':
-    handle_menu()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--network", choices=NETWORKS, default="mainnet")
+    parser.add_argument("--connect", metavar="HOST[:PORT]", help="peer to use instead of one from addresses.json")
+    args = parser.parse_args()
+    setup_logging()
+    handle_menu(NETWORKS[args.network], args.connect)
@@ -0,0 +1,51 @@
+import threading
+from collections import OrderedDict
+
+from commands.tx import Transaction
+
+
+class Mempool:
+    """Transactions seen on the network (from `tx` messages), used to rebuild compact blocks.
+
+    Bounded by max_bytes; the oldest transactions are dropped first. Keys are
+    wtxids in internal byte order.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.txs: OrderedDict[bytes, Transaction] = OrderedDict()
+        self.txids: dict[bytes, bytes] = {}  # txid -> wtxid
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.txs)
+
+    def __contains__(self, txid):
+        with self.lock:
+            return txid in self.txids or txid in self.txs
+
+    def add(self, tx: Transaction) -> bool:
+        with self.lock:
+            if tx.wtxid in self.txs:
+                return False
+            self.txs[tx.wtxid] = tx
+            self.txids[tx.txid] = tx.wtxid
+            self.size += tx.size
+            while self.size > self.max_bytes:
+                _, old = self.txs.popitem(last=False)
+                self.txids.pop(old.txid, None)
+                self.size -= old.size
+            return True
+
+    def remove_block(self, txs):
+        """Drops transactions confirmed in a block."""
+        with self.lock:
+            for tx in txs:
+                wtxid = self.txids.pop(tx.txid, None)
+                if wtxid is not None:
+                    self.size -= self.txs.pop(wtxid).size
+
+    def snapshot(self) -> list[Transaction]:
+        with self.lock:
+            return list(self.txs.values())
@@ -8,4 +8,6 @@ class Mode(Enum):
     GETDATA_BLOCK = auto(),
     GETHEADERS = auto(),
     GETBLOCKS = auto(),
+    FOLLOW_TIP = auto(),
+    WALK_BLOCKS = auto(),
     EXIT = auto()
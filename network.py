@@ -0,0 +1,50 @@
+import os
+
+from constants import GENESIS_HASH, MAGIC_BYTES, POW_LIMIT
+
+
+class Network:
+    """Parameters of one Bitcoin network and where its stores live.
+
+    Mainnet keeps the files in the working directory as before; every other
+    network gets a subdirectory named after it (like Bitcoin Core's datadir), so
+    several networks can run in one process without their stores colliding.
+    """
+
+    def __init__(self, name, magic: bytes, port: int, genesis_hash: str, data_dir="", pow_limit=POW_LIMIT):
+        self.name = name
+        self.magic = magic
+        self.port = port
+        self.genesis_hash = genesis_hash  # hex, kolejnosc jak w eksploratorach
+        self.data_dir = data_dir
+        self.pow_limit = pow_limit
+
+    @property
+    def genesis(self) -> bytes:
+        """Genesis hash in internal byte order."""
+        return bytes.fromhex(self.genesis_hash)[::-1]
+
+    def path(self, filename) -> str:
+        if not self.data_dir:
+            return filename
+        return os.path.join(self.data_dir, filename)
+
+    def __str__(self):
+        return f"{self.name} (magic {self.magic.hex()}, port {self.port})"
+
+
+MAINNET = Network("mainnet", MAGIC_BYTES, 8333, GENESIS_HASH)
+
+NETWORKS = {
+    "mainnet": MAINNET,
+    "testnet": Network("testnet", bytes.fromhex("0b110907"), 18333,
+                       "000000000933ea01ad0ee984209779baaec3ced90fa3f408719526f8d77f4943", "testnet3"),
+    "testnet4": Network("testnet4", bytes.fromhex("1c163f28"), 48333,
+                        "00000000da84f2bafbbc53dee25a72ae507ff4914b867c565be350b0da8bf043", "testnet4"),
+    "signet": Network("signet", bytes.fromhex("0a03cf40"), 38333,
+                      "00000008819873e925422c1ff0f99f7cc9bbb232af63a077a480a3633bee1ef6", "signet",
+                      0x00000377ae << 216),
+    "regtest": Network("regtest", bytes.fromhex("fabfb5da"), 18444,
+                       "0f9188f13cb7b2c71f2a335e3a4fc328bf5beb436012afca590b1a11466e2206", "regtest",
+                       (1 << 255) - 1),
+}
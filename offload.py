@@ -0,0 +1,113 @@
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+from commands.block import Block
+from commands.headers import Headers
+from commands.inv import Inv
+from commands.tx import Transaction
+from utils import double_sha256
+
+# inv i tx oplaca sie oddawac dopiero od pewnego rozmiaru
+MIN_OFFLOAD_SIZE = {"block": 0, "headers": 0, "inv": 36 * 100, "tx": 64 * 1024}
+
+
+def decode_payload(command, payload):
+    """Heavy part of handling a message: parsing and hashing. Runs in a worker."""
+    if command == "block":
+        return Block(payload)
+    if command == "headers":
+        block_headers = Headers.parse_block_headers(payload.hex())
+        return block_headers, [double_sha256(bytes.fromhex(h)) for h in block_headers]
+    if command == "inv":
+        return Inv().unpack_transactions(payload.hex())
+    if command == "tx":
+        return Transaction(payload)
+    raise ValueError("nothing to decode for " + command)
+
+
+def decode_shared(command, name, size):
+    # payload czytamy z pamieci wspoldzielonej zamiast przesylac go (i kopiowac) przez pickle
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        payload = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+    return decode_payload(command, payload)
+
+
+class PayloadOffloader:
+    """Decodes block, headers and large inv/tx payloads off the socket-reading thread.
+
+    mode="thread" uses a ThreadPoolExecutor (sha256 in hashlib releases the GIL
+    on large inputs, the Python-level parsing does not); mode="process" uses a
+    ProcessPoolExecutor and hands the payload over in shared memory. Results are
+    passed to their callbacks by one delivery thread in submission order. Messages
+    that are not worth decoding in a worker can be submitted too: they skip the
+    pool but keep their place in the queue, so handlers run in the order the
+    messages arrived. At most max_pending messages are in flight; submit() blocks
+    beyond that, which stops reading from the socket and pushes back on the peer.
+    """
+
+    def __init__(self, mode="thread", workers=None, max_pending=32):
+        self.logger = logging.getLogger('bitcoin')
+        self.mode = mode
+        workers = workers or os.cpu_count() or 2
+        if mode == "process":
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode")
+        self.pending = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._deliver, name="decode-delivery", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def should_offload(command, payload):
+        min_size = MIN_OFFLOAD_SIZE.get(command)
+        return min_size is not None and len(payload) >= min_size
+
+    def submit(self, command, payload, callback, on_error=None):
+        """callback(decoded) is called later, after the callbacks of earlier submissions.
+
+        decoded is None for messages below the offload size. If decoding or the
+        callback raises, on_error(exception) is called instead of only logging it.
+        """
+        shm = None
+        if not self.should_offload(command, payload):
+            future = Future()
+            future.set_result(None)
+        elif self.mode == "process":
+            shm = shared_memory.SharedMemory(create=True, size=max(len(payload), 1))
+            shm.buf[:len(payload)] = payload
+            future = self.executor.submit(decode_shared, command, shm.name, len(payload))
+        else:
+            future = self.executor.submit(decode_payload, command, payload)
+        self.pending.put((command, future, callback, on_error, shm))
+
+    def close(self):
+        self.pending.put(None)
+        self._thread.join()
+        self.executor.shutdown()
+
+    def _deliver(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            command, future, callback, on_error, shm = item
+            try:
+                callback(future.result())
+            except Exception as e:
+                self.logger.info("Handling " + command + " failed: " + repr(e))
+                if on_error is not None:
+                    try:
+                        on_error(e)
+                    except Exception as error:
+                        self.logger.error("on_error for " + command + " failed: " + repr(error))
+            finally:
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
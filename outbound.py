@@ -0,0 +1,186 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from constants import MAGIC_BYTES
+from utils import message_header
+
+IOV_MAX = 1024  # limit buforow w jednym sendmsg na Linuksie
+
+
+class TokenBucket:
+    """Rate limit: rate tokens (bytes, messages, addresses) per second with bursts up to `burst`.
+
+    reserve() always takes the bytes, going into debt for messages larger than
+    the bucket, and returns how long the caller should wait before sending them.
+    One bucket can be shared by many writers to get a global limit. take() is the
+    non-blocking variant used to cap what a peer may make us process.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, n) -> float:
+        with self.lock:
+            self._refill()
+            self.tokens -= n
+            return max(0.0, -self.tokens / self.rate)
+
+    def take(self, n) -> int:
+        """Takes up to n whole tokens without going into debt; returns how many there were."""
+        with self.lock:
+            self._refill()
+            taken = max(0, min(n, int(self.tokens)))
+            self.tokens -= taken
+            return taken
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class OutboundWriter:
+    """Sends a connection's messages from its own thread.
+
+    Header and payload are queued as separate buffers and written with one
+    sendmsg() (scatter-gather, no concatenation), together with whatever else is
+    queued at that moment - small messages (pong, getdata, sendcmpct) are held
+    for coalesce_delay seconds so bursts go out in one syscall. Partial writes are
+    continued until everything is sent. `rate` limits this peer, `global_bucket`
+    (a TokenBucket shared between writers) all of them. Producers block in send()
+    while more than high_water bytes are waiting, so a slow peer cannot make us
+    buffer without bound.
+    """
+
+    def __init__(self, client, rate=None, global_bucket=None, high_water=4 * 1024 * 1024,
+                 coalesce_delay=0.002, small_batch=1024, max_batch=256 * 1024, magic=MAGIC_BYTES):
+        self.logger = logging.getLogger('bitcoin')
+        self.client = client
+        self.magic = magic
+        self.bucket = TokenBucket(rate) if rate else None
+        self.global_bucket = global_bucket
+        self.high_water = high_water
+        self.coalesce_delay = coalesce_delay
+        self.small_batch = small_batch
+        self.max_batch = max_batch
+        self.buffers: deque[bytes] = deque()
+        self.pending = 0
+        self.cond = threading.Condition()
+        self.closed = False
+        self.error: OSError | None = None
+        self.messages = 0
+        self.syscalls = 0
+        self.bytes_sent = 0
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="outbound", daemon=True)
+        self._thread.start()
+
+    def send(self, command, payload=b'', timeout=None) -> bool:
+        """Queues one message; False if the connection is broken or the queue stayed full for timeout s."""
+        header = message_header(command, payload, self.magic)
+        return self._enqueue((header, payload) if payload else (header,), timeout)
+
+    def send_raw(self, message: bytes, timeout=None) -> bool:
+        """Queues already built message(s), e.g. the constant getheaders or the pre-verack batch."""
+        return self._enqueue((message,), timeout)
+
+    def flush(self, timeout=None) -> bool:
+        with self.cond:
+            return self.cond.wait_for(lambda: self.pending == 0 or self.closed, timeout) and self.pending == 0
+
+    def close(self, flush_timeout=1.0):
+        if not self.closed:
+            self.flush(flush_timeout)
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self._wake.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join(flush_timeout)
+
+    def stats(self):
+        with self.cond:
+            return {"messages": self.messages, "syscalls": self.syscalls, "bytes": self.bytes_sent,
+                    "pending": self.pending}
+
+    def _enqueue(self, buffers, timeout):
+        size = sum(len(b) for b in buffers)
+        with self.cond:
+            # backpressure: producent czeka, az writer zejdzie ponizej high water mark
+            if not self.cond.wait_for(lambda: self.closed or self.pending < self.high_water, timeout):
+                self.logger.info(f"Outbound queue full ({self.pending} bytes), message dropped")
+                return False
+            if self.closed:
+                return False
+            self.buffers.extend(buffers)
+            self.pending += size
+            self.messages += 1
+            self.cond.notify_all()
+        return True
+
+    def _take_batch(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.buffers or self.closed)
+            if self.closed:
+                return None
+            if self.pending < self.small_batch and self.coalesce_delay:
+                self.cond.wait_for(lambda: self.pending >= self.small_batch or self.closed, self.coalesce_delay)
+            batch = []
+            size = 0
+            while self.buffers and len(batch) < IOV_MAX and (not batch or size + len(self.buffers[0]) <= self.max_batch):
+                buffer = self.buffers.popleft()
+                batch.append(buffer)
+                size += len(buffer)
+            return batch, size
+
+    def _run(self):
+        while True:
+            taken = self._take_batch()
+            if taken is None:
+                return
+            batch, size = taken
+            delay = max(self.bucket.reserve(size) if self.bucket else 0.0,
+                        self.global_bucket.reserve(size) if self.global_bucket else 0.0)
+            if delay and self._wake.wait(delay):
+                return
+            try:
+                syscalls = self._write(batch)
+            except OSError as e:
+                self.logger.info("Send failed: " + str(e))
+                with self.cond:
+                    self.error = e
+                    self.closed = True
+                    self.buffers.clear()
+                    self.pending = 0
+                    self.cond.notify_all()
+                return
+            with self.cond:
+                self.pending -= size
+                self.bytes_sent += size
+                self.syscalls += syscalls
+                self.cond.notify_all()
+
+    def _write(self, batch) -> int:
+        if not hasattr(self.client, "sendmsg"):
+            # np. Windows - bez scatter-gather, jeden bufor
+            self.client.sendall(b''.join(batch))
+            return 1
+        views = [memoryview(b) for b in batch]
+        first = 0
+        syscalls = 0
+        while first < len(views):
+            sent = self.client.sendmsg(views[first:])
+            syscalls += 1
+            # czesciowy zapis: pomijamy wyslane bufory, pierwszy niewyslany przycinamy
+            while first < len(views) and sent >= len(views[first]):
+                sent -= len(views[first])
+                first += 1
+            if sent:
+                views[first] = views[first][sent:]
+        return syscalls
@@ -0,0 +1,71 @@
+import logging
+
+from outbound import TokenBucket
+
+BAN_SCORE = 100
+BAN_DURATION = 24 * 60 * 60
+
+# punkty za naruszenia, mniej wiecej jak w Bitcoin Core
+OVERSIZED_SCORE = 100
+MALFORMED_SCORE = 20
+TOO_MANY_ITEMS_SCORE = 20
+FLOOD_SCORE = 1
+
+
+class PeerGuard:
+    """Misbehavior score and inbound rate limits of one connection.
+
+    Every message takes a token from a message bucket; messages above the rate
+    are dropped and each costs FLOOD_SCORE. inv items and gossiped addresses have
+    their own buckets (addr: 0.1/s with a burst of 1000, as in Bitcoin Core) and
+    whatever is above them is dropped without a penalty. Once the score reaches
+    ban_score the peer's IP is banned in the AddrStore for ban_duration seconds
+    and `banned` tells the reading loop to drop the connection.
+    """
+
+    def __init__(self, client, node, addr_store=None, ban_score=BAN_SCORE, ban_duration=BAN_DURATION,
+                 message_rate=200.0, message_burst=5000, inv_rate=1000.0, inv_burst=50_000,
+                 addr_rate=0.1, addr_burst=1000):
+        self.logger = logging.getLogger('bitcoin')
+        self.client = client
+        self.node = node
+        self.addr_store = addr_store
+        self.ban_score = ban_score
+        self.ban_duration = ban_duration
+        self.messages = TokenBucket(message_rate, message_burst)
+        self.inv_items = TokenBucket(inv_rate, inv_burst)
+        self.addr_items = TokenBucket(addr_rate, addr_burst)
+        self.score = 0
+        self.banned = False
+        self.dropped = 0
+
+    def allow_message(self) -> bool:
+        if self.messages.take(1):
+            return True
+        self.dropped += 1
+        self.misbehaving(FLOOD_SCORE, "message flood")
+        return False
+
+    def allow_inv(self, count) -> int:
+        """How many of count inv items may be processed."""
+        return self._allow(self.inv_items, count)
+
+    def allow_addr(self, count) -> int:
+        """How many of count gossiped addresses may be processed."""
+        return self._allow(self.addr_items, count)
+
+    def misbehaving(self, points, reason) -> bool:
+        """Adds to the score; returns True when the peer got banned by it."""
+        self.score += points
+        self.logger.info(f"Peer {self.node} misbehaving (+{points} -> {self.score}): {reason}")
+        if self.banned or self.score < self.ban_score:
+            return False
+        self.banned = True
+        if self.addr_store is not None and self.node is not None and self.node.host_v4 is not None:
+            self.addr_store.ban(self.node.host_v4, self.ban_duration, reason)
+        return True
+
+    def _allow(self, bucket, count):
+        allowed = bucket.take(count)
+        self.dropped += count - allowed
+        return allowed
@@ -0,0 +1,130 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+
+from cache import LRUCache
+from commands.block import Block
+from utils import make_parent_dir
+
+
+class TxIndex:
+    """txid -> (height, offset) and script hash -> outpoints index over streamed blocks (SQLite).
+
+    Outputs are kept with the height that spent them, so unspent outputs per script
+    (UTXO-lite) are one indexed query and a reorg is undone by deleting rows at or
+    above the fork height and clearing spent_height there. Blocks are buffered and
+    written in one transaction every batch_blocks blocks; recent txid lookups are
+    served from an LRU cache.
+    """
+
+    def __init__(self, path="tx_index.sqlite", batch_blocks=50, cache_size=100_000):
+        self.logger = logging.getLogger('bitcoin')
+        make_parent_dir(path)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.batch_blocks = batch_blocks
+        self.cache = LRUCache(cache_size, name="tx index")
+        self.pending_blocks = []
+        self.pending_txs = []
+        self.pending_outputs = []
+        self.pending_spends = []
+        self.db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS blocks (height INTEGER PRIMARY KEY, hash BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS txs (txid BLOB PRIMARY KEY, height INTEGER NOT NULL, offset INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS outputs (
+                txid BLOB NOT NULL, vout INTEGER NOT NULL, script_hash BLOB NOT NULL, value INTEGER NOT NULL,
+                height INTEGER NOT NULL, spent_height INTEGER, PRIMARY KEY (txid, vout));
+            CREATE INDEX IF NOT EXISTS outputs_script ON outputs (script_hash);
+            CREATE INDEX IF NOT EXISTS txs_height ON txs (height);
+            CREATE INDEX IF NOT EXISTS outputs_height ON outputs (height);
+            CREATE INDEX IF NOT EXISTS outputs_spent ON outputs (spent_height);
+        """)
+
+    @staticmethod
+    def script_hash(script: bytes) -> bytes:
+        return hashlib.sha256(script).digest()
+
+    def tip_height(self):
+        with self.lock:
+            if self.pending_blocks:
+                return self.pending_blocks[-1][0]
+            row = self.db.execute("SELECT MAX(height) FROM blocks").fetchone()
+            return row[0]
+
+    def is_indexed(self, height: int, block_hash: bytes) -> bool:
+        with self.lock:
+            if (height, block_hash) in self.pending_blocks:
+                return True
+            row = self.db.execute("SELECT 1 FROM blocks WHERE height = ? AND hash = ?", (height, block_hash)).fetchone()
+            return row is not None
+
+    def index_block(self, block: Block, height: int) -> None:
+        """Adds a block; one already indexed at this height (delivered twice) is skipped."""
+        with self.lock:
+            if self.is_indexed(height, block.hash):
+                return
+            self.pending_blocks.append((height, block.hash))
+            for tx, offset in zip(block.txs, block.offsets):
+                self.pending_txs.append((tx.txid, height, offset))
+                self.cache.put(tx.txid, (height, offset))
+                for vout, (value, script) in enumerate(tx.outputs):
+                    self.pending_outputs.append((tx.txid, vout, self.script_hash(script), value, height))
+                if not tx.is_coinbase():
+                    for prev_txid, vout in tx.inputs:
+                        self.pending_spends.append((height, prev_txid, vout))
+            if len(self.pending_blocks) >= self.batch_blocks:
+                self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            if not self.pending_blocks:
+                return
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO blocks VALUES (?, ?)", self.pending_blocks)
+                self.db.executemany("INSERT OR REPLACE INTO txs VALUES (?, ?, ?)", self.pending_txs)
+                # OR IGNORE: istniejacy wiersz moze miec juz spent_height z pozniejszego bloku
+                self.db.executemany("INSERT OR IGNORE INTO outputs VALUES (?, ?, ?, ?, ?, NULL)", self.pending_outputs)
+                self.db.executemany("UPDATE outputs SET spent_height = ? WHERE txid = ? AND vout = ?", self.pending_spends)
+            self.logger.debug(f"tx index: flushed {len(self.pending_blocks)} blocks, {len(self.pending_txs)} txs\n")
+            self.pending_blocks, self.pending_txs, self.pending_outputs, self.pending_spends = [], [], [], []
+
+    def disconnect_to(self, fork_height: int) -> None:
+        """Reorg: forgets everything indexed at or above fork_height."""
+        with self.lock:
+            self.flush()
+            with self.db:
+                self.db.execute("DELETE FROM blocks WHERE height >= ?", (fork_height,))
+                self.db.execute("DELETE FROM txs WHERE height >= ?", (fork_height,))
+                self.db.execute("DELETE FROM outputs WHERE height >= ?", (fork_height,))
+                self.db.execute("UPDATE outputs SET spent_height = NULL WHERE spent_height >= ?", (fork_height,))
+            self.cache.clear()
+            self.logger.info("tx index: disconnected blocks from height " + str(fork_height))
+
+    def find_tx(self, txid: bytes) -> tuple[int, int] | None:
+        """(height, offset in block) for a txid in internal byte order."""
+        with self.lock:
+            location = self.cache.get(txid)
+            if location is not None:
+                return location
+            self.flush()
+            row = self.db.execute("SELECT height, offset FROM txs WHERE txid = ?", (txid,)).fetchone()
+            if row is not None:
+                self.cache.put(txid, row)
+            return row
+
+    def outpoints(self, script: bytes, unspent_only=True) -> list[tuple[bytes, int, int, int]]:
+        """(txid, vout, value, height) of outputs paying to script."""
+        self.flush()
+        query = "SELECT txid, vout, value, height FROM outputs WHERE script_hash = ?"
+        if unspent_only:
+            query += " AND spent_height IS NULL"
+        with self.lock:
+            return self.db.execute(query, (self.script_hash(script),)).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.db.close()
@@ -1,6 +1,12 @@
 import hashlib
-from datetime import datetime
-import numpy as np
+import os
+import struct
+
+from cache import LRUCache
+from constants import MAGIC_BYTES, MAX_PAYLOAD_SIZE, MAX_PAYLOAD_SIZES
+
+MAX_CACHED_CHECKSUM_PAYLOAD = 1024
+_checksums = LRUCache(4096, name="checksum")
 
 # pads the hex string with trailing zeros up to a specified length, taking the existing digits into account
 def append_zeros_right(hex_str, length):
@@ -15,14 +21,12 @@ def del_x00(hex_str):
 # def del_b_and_apos(hex_str): # deletes b'' from bytes string
 
 # reverse hex number and returns string
+# odd-length input is padded with a leading zero, so hex(0x1a2) -> "a201"
 def reverse_hex(hex_str):
-    b = del_0x(hex_str)[::-1]
+    b = del_0x(hex_str)
     if len(b) % 2 == 1:
-        b += '0'
-    list2d = hex_string_to_2d_list(b)
-    np_arr = np.array(list2d)
-    list2d = np_arr.flatten()
-    return "".join(list2d)
+        b = '0' + b
+    return "".join(b[i:i + 2] for i in range(len(b) - 2, -1, -2))
 
 def hex_string_to_2d_list(b) -> list[list[int]]:
     len_b = int(len(b) / 2)
@@ -41,11 +45,106 @@ def hex_string_to_2d_list(b) -> list[list[int]]:
 def del_colons(IPv6: str):
     return IPv6.replace(':', '')
 
+def make_parent_dir(path):
+    """Creates the directory a store file lives in; files in the working directory need none."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
 def checksum_f(hex_str: str): # f - oznacza ze to funkcja, dla odroznienia od checksum
-    data = bytes.fromhex(hex_str)
-    hash1 = hashlib.sha256(data).digest()
-    hash2 = hashlib.sha256(hash1).hexdigest()
-    return hash2[:8]
+    return checksum_bytes(bytes.fromhex(hex_str)).hex()
+
+# pierwsze 4 bajty podwojnego sha256; male payloady (getdata, getheaders, pong) z cache
+def checksum_bytes(data: bytes) -> bytes:
+    if type(data) is not bytes or len(data) > MAX_CACHED_CHECKSUM_PAYLOAD:
+        return hashlib.sha256(hashlib.sha256(data).digest()).digest()[:4]
+    checksum = _checksums.get(data)
+    if checksum is None:
+        checksum = hashlib.sha256(hashlib.sha256(data).digest()).digest()[:4]
+        _checksums.put(data, checksum)
+    return checksum
+
+# podwojny sha256 (hash bloku, txid)
+def double_sha256(data: bytes) -> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+# sam 24-bajtowy naglowek wiadomosci (magic, komenda, rozmiar, checksum)
+def message_header(command: str, payload: bytes = b'', magic: bytes = MAGIC_BYTES) -> bytes:
+    return magic + command.encode('ascii').ljust(12, b'\x00') + \
+        struct.pack('<I', len(payload)) + checksum_bytes(payload)
+
+# metoda sklada gotowa wiadomosc (naglowek + payload) jako bytes
+def build_message(command: str, payload: bytes = b'', magic: bytes = MAGIC_BYTES) -> bytes:
+    return message_header(command, payload, magic) + payload
+
+# odczyt varint (CompactSize) z ciagu bajtow, zwraca (wartosc, offset za varintem)
+def read_varint(data: bytes, offset: int = 0) -> tuple[int, int]:
+    prefix = data[offset]
+    if prefix < 0xfd:
+        return prefix, offset + 1
+    if prefix == 0xfd:
+        return struct.unpack_from('<H', data, offset + 1)[0], offset + 3
+    if prefix == 0xfe:
+        return struct.unpack_from('<I', data, offset + 1)[0], offset + 5
+    return struct.unpack_from('<Q', data, offset + 1)[0], offset + 9
+
+# zapis int jako varint (CompactSize)
+def varint_bytes(number: int) -> bytes:
+    if number < 0xfd:
+        return bytes([number])
+    if number <= 0xffff:
+        return b'\xfd' + struct.pack('<H', number)
+    if number <= 0xffffffff:
+        return b'\xfe' + struct.pack('<I', number)
+    return b'\xff' + struct.pack('<Q', number)
+
+# odczyt dokladnie n bajtow z gniazda (recv moze zwrocic mniej); None gdy polaczenie zamkniete
+def recv_exact(client, n) -> bytes | None:
+    data = bytearray()
+    while len(data) < n:
+        chunk = client.recv(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+class OversizedMessage(ValueError):
+    """Peer announced a payload above the limit for its command; the stream cannot be trusted any more."""
+
+    def __init__(self, command, size):
+        super().__init__(f"{command} payload of {size} bytes is over the limit")
+        self.command = command
+        self.size = size
+
+class MalformedMessage(ValueError):
+    """Payload that does not parse, e.g. truncated; PeerGuard scores it as malformed."""
+
+    def __init__(self, command, reason):
+        super().__init__(f"malformed {command}: {reason}")
+        self.command = command
+
+# odczyt jednej wiadomosci: (command, payload, checksum) albo None gdy polaczenie zamkniete
+# po smieciach w strumieniu szuka kolejnych magic bytes
+# rozmiar z naglowka sprawdzamy przed recv - peer nie moze kazac nam zaalokowac dowolnej ilosci pamieci
+def read_frame(client, magic: bytes = MAGIC_BYTES):
+    window = recv_exact(client, 4)
+    while window is not None and window != magic:
+        byte = recv_exact(client, 1)
+        window = None if byte is None else window[1:] + byte
+    if window is None:
+        return None
+
+    header = recv_exact(client, 20)
+    if header is None:
+        return None
+    command = header[:12].rstrip(b'\x00').decode('ascii', 'replace')
+    size = struct.unpack_from('<I', header, 12)[0]
+    if size > MAX_PAYLOAD_SIZES.get(command, MAX_PAYLOAD_SIZE):
+        raise OversizedMessage(command, size)
+    payload = recv_exact(client, size)
+    if payload is None:
+        return None
+    return command, payload, header[16:20]
 
 # metoda oblicza rozmiar payload
 def count_payload(hex_str, length):